@@ -4,16 +4,47 @@ from urllib3 import Retry
 import urllib.parse
 import time
 import queue
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import itertools
 import math
 import sqlite3
 import json
 import os
 import hashlib
 import csv
-import copy
-from collections import OrderedDict
-from contextlib import closing
+from collections import OrderedDict, deque
+from contextlib import closing, contextmanager
+import asyncio
+import threading
+import weakref
+import atexit
+import zlib
+import gzip
+import pickle
+import tempfile
+import multiprocessing
+import socket
+import logging
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import h3
+except ImportError:
+    h3 = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 csv.field_size_limit(100000000)
 
@@ -40,93 +71,1090 @@ def flatten(nested, separator="_", root_keys_to_ignore=None):
     return out
 
 
+def _spatialCell(latitude, longitude):
+    # h3 resolution 4 when the h3 package is installed, otherwise a 0.4 degree grid cell of similar size
+    latitude = float(latitude)
+    longitude = float(longitude)
+    if h3 is not None:
+        if hasattr(h3, 'latlng_to_cell'):
+            return h3.latlng_to_cell(latitude, longitude, 4)
+        return h3.geo_to_h3(latitude, longitude, 4)
+    return f"{math.floor(latitude / 0.4)}_{math.floor(longitude / 0.4)}"
+
+
+def _bboxAreaKm2(minlat, maxlat, minlng, maxlng):
+    # area of a latitude/longitude bounding box on the sphere
+    r = 6371.0088
+    return r * r * math.radians(maxlng - minlng) * abs(math.sin(math.radians(maxlat)) - math.sin(math.radians(minlat)))
+
+
+def _mortonKey(latitude, longitude):
+    # z-order key at ~0.1 degree so consecutive points are spatially close
+    y = int((float(latitude) + 90) * 10)
+    x = int((float(longitude) + 180) * 10)
+    key = 0
+    for bit in range(12):
+        key |= ((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)
+    return key
+
+
+def _jsonLoads(payload):
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def _jsonDumps(obj, sortkeys=False):
+    # compact utf-8 bytes. orjson and json agree except for floats written in exponent form (1e16 vs 1e+16)
+    # and non-finite floats (null vs NaN), so fasthash keys for such bodies depend on whether orjson is installed
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sortkeys else 0))
+        except TypeError:
+            pass
+    return json.dumps(obj, sort_keys=sortkeys, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _endpointNamespace(url):
+    # e.g. https://api.costquest.com/fabric/202412/data/locations?uuid=x -> ('fabric/data/locations', '202412')
+    if url is None:
+        return None, None
+    parsed = urllib.parse.urlparse(url)
+    endpoint = []
+    vintage = None
+    for segment in parsed.path.strip('/').split('/'):
+        if vintage is None and len(segment) == 6 and segment.isdigit():
+            vintage = segment
+        elif segment != '':
+            endpoint.append(segment)
+    if vintage is None:
+        vintage = dict(urllib.parse.parse_qsl(parsed.query)).get('vintage')
+    return '/'.join(endpoint), vintage
+
+
+def _shardPath(jobdir, index, suffix):
+    return os.path.join(jobdir, f'shard-{index:05d}.{suffix}')
+
+
+def _claimAvailable(jobdir, index, claimttl):
+    # true when nobody holds the shard, or the holder stopped refreshing its claim for claimttl seconds
+    try:
+        return time.time() - os.path.getmtime(_shardPath(jobdir, index, 'lock')) > claimttl
+    except FileNotFoundError:
+        return True
+
+
+def _heartbeat(path, interval, stop):
+    # keeps a lock file fresh while its owner is alive, so it is only ever taken over from a dead host
+    while not stop.wait(interval):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+
+def _claimShard(jobdir, index, claimttl):
+    lockpath = _shardPath(jobdir, index, 'lock')
+    for attempt in range(2):
+        try:
+            fd = os.open(lockpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not _claimAvailable(jobdir, index, claimttl) or attempt > 0 or os.path.exists(_shardPath(jobdir, index, 'result.jsonl')):
+                return False
+            # the claim outlived claimttl, presumably a crashed worker, so the shard is taken over
+            try:
+                os.remove(lockpath)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, 'w') as lockfile:
+            lockfile.write(f'{socket.gethostname()} {os.getpid()} {time.time()}')
+        return True
+    return False
+
+
+def _runShard(config, jobdir, index, cachepath, cacheseed, claimttl):
+    # runs in a child process, returns 1 when this process ran the shard
+    if os.path.exists(_shardPath(jobdir, index, 'result.jsonl')) or not _claimShard(jobdir, index, claimttl):
+        return 0
+    lockpath = _shardPath(jobdir, index, 'lock')
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(lockpath, claimttl / 5, stop), daemon=True)
+    heartbeat.start()
+    try:
+        with open(os.path.join(jobdir, 'manifest.json'), 'rb') as rfile:
+            manifest = _jsonLoads(rfile.read())
+        with open(_shardPath(jobdir, index, 'jsonl'), 'rb') as rfile:
+            items = [_jsonLoads(line) for line in rfile if line.strip()]
+        with cqazapipytools(cachepath=cachepath, cacheseed=cacheseed, **config) as cp:
+            results = getattr(cp, manifest['operation'])(manifest['vintage'], items, **manifest['kwargs']) if len(items) > 0 else []
+            resultpath = _shardPath(jobdir, index, 'result.jsonl')
+            cp.jsonlWrite(resultpath + '.tmp', results)
+        os.replace(resultpath + '.tmp', resultpath)
+    except BaseException:
+        # release the claim so the shard can be picked up again
+        try:
+            os.remove(lockpath)
+        except FileNotFoundError:
+            pass
+        raise
+    finally:
+        stop.set()
+    return 1
+
+
+class _Metrics:
+    # thread safe counters and latency histograms labelled by endpoint and method
+
+    COUNTERS = ('requests', 'errors', 'cache_hits', 'cache_misses', 'retries', 'ratelimit_waits', 'ratelimit_wait_seconds', 'bytes_sent', 'bytes_received', 'credits', 'coalesced', 'deduplicated')
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name, endpoint='', method='', value=1):
+        key = (name, endpoint or '', method.upper())
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, endpoint, method, seconds):
+        key = (endpoint or '', method.upper())
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * (len(self.BUCKETS) + 1), 'count': 0, 'sum': 0.0}
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            else:
+                histogram['buckets'][-1] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+
+    def _quantile(self, histogram, q):
+        # upper bound of the bucket holding the quantile
+        target = q * histogram['count']
+        running = 0
+        for i, n in enumerate(histogram['buckets']):
+            running += n
+            if running >= target and n > 0:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else float('inf')
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: {'buckets': list(v['buckets']), 'count': v['count'], 'sum': v['sum']} for k, v in self.histograms.items()}
+        totals = {name: 0 for name in self.COUNTERS}
+        endpoints = {}
+        for (name, endpoint, method), value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+            label = f'{method} {endpoint}'.strip()
+            endpoints.setdefault(label, {})[name] = value
+        for (endpoint, method), histogram in histograms.items():
+            label = f'{method} {endpoint}'.strip()
+            endpoints.setdefault(label, {})['latency'] = {
+                'count': histogram['count'],
+                'mean': histogram['sum'] / histogram['count'] if histogram['count'] > 0 else None,
+                'p50': self._quantile(histogram, 0.5),
+                'p99': self._quantile(histogram, 0.99),
+            }
+        lookups = totals['cache_hits'] + totals['cache_misses']
+        totals['cache_hit_ratio'] = totals['cache_hits'] / lookups if lookups > 0 else None
+        totals['endpoints'] = endpoints
+        return totals
+
+    def prometheus(self, prefix='cqazapipytools'):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, {'buckets': list(v['buckets']), 'count': v['count'], 'sum': v['sum']}) for k, v in self.histograms.items())
+        lines = []
+        for name in self.COUNTERS:
+            rows = [(k, v) for k, v in counters if k[0] == name]
+            if len(rows) == 0:
+                continue
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            for (_, endpoint, method), value in rows:
+                lines.append(f'{prefix}_{name}_total{{endpoint="{endpoint}",method="{method}"}} {value}')
+        if len(histograms) > 0:
+            lines.append(f'# TYPE {prefix}_request_seconds histogram')
+        for (endpoint, method), histogram in histograms:
+            labels = f'endpoint="{endpoint}",method="{method}"'
+            running = 0
+            for bound, n in zip(list(self.BUCKETS) + ['+Inf'], histogram['buckets']):
+                running += n
+                lines.append(f'{prefix}_request_seconds_bucket{{{labels},le="{bound}"}} {running}')
+            lines.append(f'{prefix}_request_seconds_sum{{{labels}}} {histogram["sum"]}')
+            lines.append(f'{prefix}_request_seconds_count{{{labels}}} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+class _CacheReader:
+    __slots__ = ('cn', '__weakref__')
+
+    def __init__(self, cn):
+        self.cn = cn
+
+
+class _CacheEngine:
+    # sqlite cache with one long lived read connection per thread and a single background writer thread
+    # that commits queued rows in batched transactions. rows waiting on the writer are served from memory.
+    # every row carries created/accessed timestamps, its byte size and the endpoint/vintage it came from so
+    # the cache can be bounded by ttl, entry count or bytes (least recently used first) and purged by namespace.
+
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path, compression=None, batchsize=1000, maxbytes=None, maxentries=None, ttl=None, enforceevery=1000, seed=None):
+        if compression not in (None, 'zlib', 'zstd'):
+            raise Exception("Unsupported cache compression, use None, 'zlib' or 'zstd'")
+        if compression == 'zstd' and zstandard is None:
+            raise Exception("Cache compression 'zstd' requires the zstandard package to be installed")
+        self.path = path
+        self.compression = compression
+        self.batchsize = batchsize
+        self.maxbytes = maxbytes
+        self.maxentries = maxentries
+        self.ttl = ttl
+        self.enforceevery = enforceevery
+        self.seed = seed
+        self.local = threading.local()
+        self.readers = weakref.WeakSet()
+        self.readerslock = threading.Lock()
+        self.pending = {}
+        self.pendinglock = threading.Lock()
+        self.writequeue = queue.Queue()
+        self.error = None
+        self.closed = False
+        with closing(self._connect()) as cn:
+            # only takes effect on new files, older files switch over on vacuum(full=True)
+            cn.execute('PRAGMA auto_vacuum=INCREMENTAL;')
+            cn.execute('PRAGMA journal_mode=WAL;')
+            self._migrate(cn)
+        self.writer = threading.Thread(target=self._writeLoop, name='cqazapipytools-cache-writer', daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+        if self._hasPolicy():
+            self.writequeue.put(('call', self._enforce, None))
+
+    def _connect(self):
+        cn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        cn.execute('PRAGMA synchronous=NORMAL;')
+        return cn
+
+    def _migrate(self, cn):
+        version = cn.execute('PRAGMA user_version;').fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+        exists = cn.execute("select count(*) from sqlite_master where type='table' and name='cache';").fetchone()[0] > 0
+        now = time.time()
+        with cn:
+            if version < 1:
+                cn.execute('create table if not exists cache_v1 (hashvalue text primary key, response blob not null, encoding text not null);')
+                if exists:
+                    # pre engine caches have no unique key, keep the most recently written row for each hash
+                    cn.execute("insert or replace into cache_v1 (hashvalue, response, encoding) select hashvalue, response, 'json' from cache where response is not null order by rowid;")
+                    cn.execute('drop table cache;')
+                cn.execute('alter table cache_v1 rename to cache;')
+            if version < 2:
+                cn.execute(f'alter table cache add column created real not null default {now};')
+                cn.execute(f'alter table cache add column accessed real not null default {now};')
+                cn.execute('alter table cache add column size integer not null default 0;')
+                cn.execute('alter table cache add column endpoint text;')
+                cn.execute('alter table cache add column vintage text;')
+                if exists:
+                    cn.execute('update cache set size=length(cast(response as blob));')
+                cn.execute('create index if not exists cache_accessed on cache (accessed, size);')
+                cn.execute('create index if not exists cache_created on cache (created);')
+                cn.execute('create index if not exists cache_namespace on cache (endpoint, vintage);')
+            cn.execute(f'PRAGMA user_version={self.SCHEMA_VERSION};')
+
+    def _reader(self):
+        reader = getattr(self.local, 'reader', None)
+        if reader is None:
+            reader = _CacheReader(self._connect())
+            if self.seed is not None:
+                # a read only fallback, e.g. the main cache shared by the shards of a job
+                reader.cn.execute('attach database ? as seed;', (self.seed,))
+            self.local.reader = reader
+            with self.readerslock:
+                self.readers.add(reader)
+        return reader.cn
+
+    def _hasPolicy(self):
+        return not (self.maxbytes is None and self.maxentries is None and self.ttl is None)
+
+    def encode(self, response, raw=None):
+        # raw response bytes are stored as received instead of being serialized again
+        payload = raw if raw is not None else _jsonDumps(response)
+        if self.compression == 'zlib':
+            return zlib.compress(payload, 6), 'zlib'
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor().compress(payload), 'zstd'
+        return payload, 'json'
+
+    def decode(self, payload, encoding):
+        if encoding == 'zlib':
+            payload = zlib.decompress(payload)
+        elif encoding == 'zstd':
+            if zstandard is None:
+                raise Exception("Cache entry is zstd compressed but the zstandard package is not installed")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        return _jsonLoads(payload)
+
+    def get(self, hashvalue):
+        return self.getMany([hashvalue]).get(hashvalue)
+
+    def getMany(self, hashvalues):
+        found = {}
+        missing = []
+        with self.pendinglock:
+            for h in set(hashvalues):
+                if h in self.pending:
+                    found[h] = self.pending[h][:2]
+                else:
+                    missing.append(h)
+        cn = self._reader()
+        expiry = ''
+        params = []
+        if not self.ttl is None:
+            expiry = ' and created >= ?'
+            params = [time.time() - self.ttl]
+        for table in ['cache'] if self.seed is None else ['cache', 'seed.cache']:
+            # stay well under SQLITE_MAX_VARIABLE_NUMBER on older sqlite builds
+            for i in range(0, len(missing), 900):
+                batch = missing[i:i + 900]
+                rows = cn.execute(f"select hashvalue, response, encoding from {table} where hashvalue in ({','.join('?' * len(batch))}){expiry};", batch + params).fetchall()
+                for hashvalue, payload, encoding in rows:
+                    found[hashvalue] = (payload, encoding)
+            missing = [h for h in missing if h not in found]
+        if len(found) > 0 and not self.closed:
+            self.writequeue.put(('touch', list(found.keys())))
+        return {h: self.decode(*v) for h, v in found.items()}
+
+    def put(self, hashvalue, response, url=None, raw=None):
+        if self.error is not None:
+            raise self.error
+        if self.closed:
+            raise Exception("Cache has been closed")
+        payload, encoding = self.encode(response, raw)
+        endpoint, vintage = _endpointNamespace(url)
+        encoded = (payload, encoding, endpoint, vintage)
+        with self.pendinglock:
+            self.pending[hashvalue] = encoded
+        self.writequeue.put(('put', hashvalue, encoded))
+
+    def call(self, fn):
+        # run fn(connection) on the writer thread after everything queued before it and wait for the result
+        if self.closed:
+            raise Exception("Cache has been closed")
+        done = threading.Event()
+        outcome = {}
+        def wrapped(cn):
+            try:
+                outcome['result'] = fn(cn)
+            except Exception as e:
+                outcome['error'] = e
+        self.writequeue.put(('call', wrapped, done))
+        done.wait()
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('result')
+
+    def flush(self):
+        if self.closed:
+            return
+        self.call(lambda cn: None)
+        if self.error is not None:
+            raise self.error
+
+    def prune(self):
+        return self.call(self._enforce)
+
+    def _namespaceFilter(self, endpoint, vintage):
+        clauses = []
+        params = []
+        if not endpoint is None:
+            endpoint = endpoint.strip('/')
+            clauses.append('(endpoint = ? or endpoint like ?)')
+            params.extend([endpoint, f'{endpoint}/%'])
+        if not vintage is None:
+            clauses.append('vintage = ?')
+            params.append(str(vintage))
+        return clauses, params
+
+    def purge(self, endpoint=None, vintage=None):
+        clauses, params = self._namespaceFilter(endpoint, vintage)
+        if len(clauses) == 0:
+            raise Exception("purgeCache() requires an endpoint and/or vintage")
+        def run(cn):
+            with cn:
+                deleted = cn.execute(f"delete from cache where {' and '.join(clauses)};", params).rowcount
+            self._vacuum(cn)
+            return deleted
+        return self.call(run)
+
+    COPY = ('insert into {target}.cache (hashvalue, response, encoding, created, accessed, size, endpoint, vintage) '
+        'select hashvalue, response, encoding, created, accessed, size, endpoint, vintage from {source}.cache where {where} '
+        'on conflict(hashvalue) do update set response=excluded.response, encoding=excluded.encoding, created=excluded.created, '
+        'accessed=max(accessed, excluded.accessed), size=excluded.size, endpoint=excluded.endpoint, vintage=excluded.vintage '
+        'where excluded.created > created;')
+
+    def merge(self, path):
+        # copy the entries of another cache file into this one, the newer response wins when both have an entry
+        _CacheEngine(path).close()
+        def run(cn):
+            cn.execute('attach database ? as source;', (path,))
+            try:
+                with cn:
+                    merged = cn.execute(self.COPY.format(target='main', source='source', where='1')).rowcount
+            finally:
+                cn.execute('detach database source;')
+            if self._hasPolicy():
+                self._enforce(cn)
+            return merged
+        return self.call(run)
+
+    def export(self, path, endpoint=None, vintage=None):
+        # copy all entries, or only those of one endpoint and/or vintage, into another cache file
+        _CacheEngine(path).close()
+        clauses, params = self._namespaceFilter(endpoint, vintage)
+        def run(cn):
+            cn.execute('attach database ? as target;', (path,))
+            try:
+                with cn:
+                    exported = cn.execute(self.COPY.format(target='target', source='main', where=' and '.join(['1'] + clauses)), params).rowcount
+            finally:
+                cn.execute('detach database target;')
+            return exported
+        return self.call(run)
+
+    def vacuum(self, full=False):
+        def run(cn):
+            if full:
+                cn.execute('PRAGMA auto_vacuum=INCREMENTAL;')
+                cn.execute('VACUUM;')
+            else:
+                self._vacuum(cn)
+        self.call(run)
+
+    def stats(self):
+        def run(cn):
+            entries, size = cn.execute('select count(*), coalesce(sum(size), 0) from cache;').fetchone()
+            pagesize = cn.execute('PRAGMA page_size;').fetchone()[0]
+            freepages = cn.execute('PRAGMA freelist_count;').fetchone()[0]
+            return {'entries': entries, 'bytes': size, 'freebytes': pagesize * freepages}
+        return self.call(run)
+
+    def _vacuum(self, cn, pages=None):
+        if cn.execute('PRAGMA auto_vacuum;').fetchone()[0] == 2:
+            # executescript steps the pragma to completion, execute() only frees one page
+            if pages is None:
+                cn.executescript('PRAGMA incremental_vacuum;')
+            else:
+                cn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+
+    def _enforce(self, cn):
+        deleted = 0
+        with cn:
+            if not self.ttl is None:
+                deleted += cn.execute('delete from cache where created < ?;', (time.time() - self.ttl,)).rowcount
+            if not self.maxentries is None:
+                deleted += cn.execute('delete from cache where hashvalue in (select hashvalue from cache order by accessed desc limit -1 offset ?);', (int(self.maxentries),)).rowcount
+            if not self.maxbytes is None:
+                total = cn.execute('select coalesce(sum(size), 0) from cache;').fetchone()[0]
+                if total > self.maxbytes:
+                    deleted += cn.execute('delete from cache where hashvalue in (select hashvalue from (select hashvalue, sum(size) over (order by accessed desc, hashvalue) as running from cache) where running > ?);', (int(self.maxbytes),)).rowcount
+        if deleted > 0:
+            self._vacuum(cn)
+        return deleted
+
+    def _writeLoop(self):
+        cn = self._connect()
+        written = 0
+        try:
+            while True:
+                item = self.writequeue.get()
+                batch = []
+                touches = []
+                calls = []
+                stop = False
+                while True:
+                    if item is None:
+                        stop = True
+                    elif item[0] == 'put':
+                        batch.append(item[1:])
+                    elif item[0] == 'touch':
+                        touches.extend(item[1])
+                    else:
+                        calls.append(item[1:])
+                        # calls see everything queued before them
+                        break
+                    if len(batch) >= self.batchsize:
+                        break
+                    try:
+                        item = self.writequeue.get_nowait()
+                    except queue.Empty:
+                        break
+                now = time.time()
+                if len(batch) > 0 or len(touches) > 0:
+                    try:
+                        with cn:
+                            if len(batch) > 0:
+                                cn.executemany('insert into cache (hashvalue, response, encoding, created, accessed, size, endpoint, vintage) values (?,?,?,?,?,?,?,?) on conflict(hashvalue) do update set response=excluded.response, encoding=excluded.encoding, created=excluded.created, accessed=excluded.accessed, size=excluded.size, endpoint=excluded.endpoint, vintage=excluded.vintage;',
+                                    [(h, e[0], e[1], now, now, len(e[0]), e[2], e[3]) for h, e in batch])
+                            if len(touches) > 0:
+                                cn.executemany('update cache set accessed=? where hashvalue=?;', [(now, h) for h in touches])
+                    except Exception as e:
+                        self.error = e
+                    with self.pendinglock:
+                        for h, e in batch:
+                            if self.pending.get(h) is e:
+                                del self.pending[h]
+                    written += len(batch)
+                if self._hasPolicy() and written >= self.enforceevery:
+                    written = 0
+                    try:
+                        self._enforce(cn)
+                    except Exception as e:
+                        self.error = e
+                for fn, done in calls:
+                    try:
+                        fn(cn)
+                    except Exception as e:
+                        self.error = e
+                    if done is not None:
+                        done.set()
+                if stop:
+                    break
+        finally:
+            cn.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.writequeue.put(None)
+        self.writer.join()
+        with self.readerslock:
+            for reader in list(self.readers):
+                reader.cn.close()
+            self.readers = weakref.WeakSet()
+
+
+class _RateLimiter:
+    # shared by every worker of a client. an optional token bucket caps requests per second, an AIMD window
+    # caps requests in flight (halved on a 429, grown by one per window of successes) and a 429 pauses everyone.
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.capacity = max(1.0, rate) if rate else 0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.maxconcurrency = None
+        self.limit = None
+        self.inflight = 0
+        self.pauseduntil = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def concurrency(self, workers):
+        with self.condition:
+            previous = self.maxconcurrency
+            self.maxconcurrency = workers
+            self.limit = float(workers)
+        try:
+            yield self
+        finally:
+            with self.condition:
+                self.maxconcurrency = previous
+                self.limit = None if previous is None else float(previous)
+                self.condition.notify_all()
+
+    def _wait(self, track):
+        # seconds until a request may start, 0 when it has been admitted, None to wait for a running request to finish
+        now = time.monotonic()
+        if now < self.pauseduntil:
+            return self.pauseduntil - now
+        if track and self.limit is not None and self.inflight >= max(1, int(self.limit)):
+            return None
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+        if track:
+            self.inflight += 1
+        return 0
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self._wait(True)
+                if wait == 0:
+                    return
+                self.condition.wait(wait)
+
+    async def aacquire(self):
+        # the async transport bounds concurrency with its own semaphore, only pauses and the token bucket apply
+        while True:
+            with self.condition:
+                wait = self._wait(False)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, success=True):
+        with self.condition:
+            self.inflight -= 1
+            if success and self.limit is not None:
+                self.limit = min(float(self.maxconcurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def throttle(self, retryafter):
+        with self.condition:
+            now = time.monotonic()
+            # several workers usually see the same 429 window, only back off once for it
+            if now >= self.pauseduntil and self.limit is not None:
+                self.limit = max(1.0, self.limit / 2)
+            self.pauseduntil = max(self.pauseduntil, now + retryafter)
+            self.condition.notify_all()
+
+
+class _ChunkSizer:
+    # picks each chunk size from the latency seen so far: chunks aim for TARGETSECONDS per request and MAXBYTES per
+    # body within maxsize, halve after an error and are small enough that the items are spread over every worker
+
+    TARGETSECONDS = 2.0
+    MAXBYTES = 4 * 1024 * 1024
+
+    def __init__(self, maxsize, workers, items, itembytes):
+        self.maxsize = min(maxsize, max(1, math.ceil(items / workers)), max(1, int(self.MAXBYTES // max(1, itembytes))))
+        self.size = self.maxsize
+        self.itemseconds = None
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            return self.size
+
+    def observe(self, size, seconds):
+        with self.lock:
+            itemseconds = seconds / size
+            self.itemseconds = itemseconds if self.itemseconds is None else 0.7 * self.itemseconds + 0.3 * itemseconds
+            target = int(self.TARGETSECONDS / self.itemseconds) if self.itemseconds > 0 else self.maxsize
+            self.size = max(1, min(self.maxsize, self.size * 2, target))
+
+    def failure(self):
+        with self.lock:
+            self.size = max(1, self.size // 2)
+
+
+class _Transport:
+    # created once per client. every session mounts the same adapters, so connections are pooled and kept alive
+    # across all calls and threads. the pool size is fixed when the client is created, pools are never swapped
+    # under requests in flight.
+
+    def __init__(self, apikey, maxretries=3, poolsize=32, timeout=(10, 300), compress=None):
+        self.apikey = apikey
+        self.maxretries = maxretries
+        self.poolsize = poolsize
+        self.timeout = timeout
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.adapters = {}
+        self.sessions = {}
+
+    def adapter(self, maxretries):
+        with self.lock:
+            if maxretries not in self.adapters:
+                self.adapters[maxretries] = HTTPAdapter(pool_connections=4, pool_maxsize=self.poolsize, max_retries=Retry(
+                    respect_retry_after_header=False,
+                    total=maxretries,
+                    backoff_factor=1,
+                    status_forcelist=[401, 403, 408, 500, 502, 503, 504],
+                    allowed_methods=['GET','POST']
+                ))
+            return self.adapters[maxretries]
+
+    @contextmanager
+    def session(self, maxretries=None):
+        if maxretries is None:
+            maxretries = self.maxretries
+        sessions = self.sessions.setdefault(maxretries, queue.LifoQueue())
+        try:
+            session = sessions.get_nowait()
+        except queue.Empty:
+            adapter = self.adapter(maxretries)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        try:
+            yield session
+        finally:
+            # sessions only hold cookies and headers, the connections live in the shared adapter
+            sessions.put(session)
+
+    def request(self, session, method, url, body=None, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if 'costquest' in url.lower():
+            headers['apikey'] = self.apikey
+        if method.upper() == 'POST' and body is not None and 'files' not in kwargs:
+            data = json.dumps(body, allow_nan=False).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+            if self.compress is not None and len(data) >= self.compress:
+                data = gzip.compress(data, compresslevel=5)
+                headers['Content-Encoding'] = 'gzip'
+            kwargs['data'] = data
+        return session.request(method.upper(), url, headers=headers, timeout=self.timeout, **kwargs)
+
+    def close(self):
+        for sessions in self.sessions.values():
+            while True:
+                try:
+                    sessions.get_nowait().close()
+                except queue.Empty:
+                    break
+        with self.lock:
+            for adapter in self.adapters.values():
+                adapter.close()
+            self.adapters = {}
+
+
+class _Journal:
+    # durable record of bulk jobs: every chunk of a job with its state and result, so a restarted
+    # process can pick up only the chunks that did not complete
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.cn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.cn.execute('PRAGMA journal_mode=WAL;')
+        self.cn.execute('PRAGMA synchronous=NORMAL;')
+        with self.cn:
+            self.cn.execute('create table if not exists jobs (jobid text primary key, url text, method text, created real, completed real);')
+            self.cn.execute('create table if not exists chunks (jobid text, idx integer, state text, body text, result text, error text, updated real, url text, primary key (jobid, idx));')
+            if 'url' not in [c[1] for c in self.cn.execute('PRAGMA table_info(chunks);')]:
+                self.cn.execute('alter table chunks add column url text;')
+            # finished jobs are removed, older journals may still hold some
+            self.cn.execute('delete from chunks where jobid in (select jobid from jobs where completed is not null);')
+            self.cn.execute('delete from jobs where completed is not null;')
+
+    def create(self, jobid, url, method, chunks, cached):
+        now = time.time()
+        with self.lock, self.cn:
+            self.cn.execute('insert or replace into jobs (jobid, url, method, created, completed) values (?,?,?,?,null);', (jobid, url, method, now))
+            self.cn.execute('delete from chunks where jobid=?;', (jobid,))
+            # responses already resolved from the cache are recorded as one completed pseudo chunk
+            self.cn.execute("insert into chunks (jobid, idx, state, body, result, updated) values (?,-1,'done',null,?,?);", (jobid, json.dumps(cached), now))
+            self.cn.executemany("insert into chunks (jobid, idx, state, body, updated, url) values (?,?,'pending',?,?,?);", [(jobid, idx, json.dumps(chunk), now, chunkurl) for idx, chunkurl, chunk in chunks])
+
+    def resume(self, jobid, results):
+        with self.lock:
+            if self.cn.execute('select count(*) from jobs where jobid=? and completed is null;', (jobid,)).fetchone()[0] == 0:
+                return None
+            pending = []
+            for idx, state, body, result, chunkurl in self.cn.execute('select c.idx, c.state, c.body, c.result, coalesce(c.url, j.url) from chunks c join jobs j on j.jobid=c.jobid where c.jobid=? order by c.idx;', (jobid,)):
+                if state == 'done':
+                    result = json.loads(result)
+                    if idx == -1 or isinstance(result, list):
+                        results.extend(result)
+                    else:
+                        results.append(result)
+                else:
+                    pending.append((idx, chunkurl, json.loads(body)))
+            return pending
+
+    def complete(self, jobid, idx, result):
+        with self.lock, self.cn:
+            self.cn.execute("update chunks set state='done', result=?, error=null, updated=? where jobid=? and idx=?;", (json.dumps(result), time.time(), jobid, idx))
+
+    def fail(self, jobid, idx, error):
+        with self.lock, self.cn:
+            self.cn.execute("update chunks set state='failed', error=?, updated=? where jobid=? and idx=?;", (error, time.time(), jobid, idx))
+
+    def finish(self, jobid):
+        # the results have been returned, the journal is not a cache so the job is dropped
+        with self.lock, self.cn:
+            self.cn.execute('delete from chunks where jobid=?;', (jobid,))
+            self.cn.execute('delete from jobs where jobid=?;', (jobid,))
+
+    def jobs(self):
+        with self.lock:
+            rows = self.cn.execute("select j.jobid, j.url, j.method, j.created, sum(c.state='done'), sum(c.state='pending'), sum(c.state='failed') from jobs j join chunks c on c.jobid=j.jobid and c.idx>=0 group by j.jobid order by j.created;").fetchall()
+        return [{'jobid': r[0], 'url': r[1], 'method': r[2], 'created': r[3], 'done': r[4], 'pending': r[5], 'failed': r[6]} for r in rows]
+
+    def delete(self, jobid=None):
+        with self.lock, self.cn:
+            if jobid is None:
+                self.cn.execute('delete from chunks;')
+                self.cn.execute('delete from jobs;')
+            else:
+                self.cn.execute('delete from chunks where jobid=?;', (jobid,))
+                self.cn.execute('delete from jobs where jobid=?;', (jobid,))
+
+    def close(self):
+        with self.lock:
+            self.cn.close()
+
+
 class cqazapipytools:
+    # seconds without a heartbeat after which the lock of a host splitting a sharded job is considered dead
+    MANIFEST_TIMEOUT = 120
 
-    def __init__(self, apikey:str, baseurl:str = 'https://api.costquest.com/', cachepath:str = None, maxretries:int = 3, quietmode:bool = False):
+    def __init__(self, apikey:str, baseurl:str = 'https://api.costquest.com/', cachepath:str = None, maxretries:int = 3, quietmode:bool = False, itemcache:bool = False, cachecompression:str = None, cachemaxbytes:int = None, cachemaxentries:int = None, cachettl:float = None, ratelimit:float = None, journalpath:str = None, timeout=(10, 300), compressrequests:int = None, fasthash:bool = False, catalogpath:str = None, catalogttl:float = 86400, cacheseed:str = None, poolsize:int = 32):
         self.apikey = apikey
         self.baseurl = baseurl
-        self.sessionpool = queue.Queue()
+        self.timeout = timeout
+        self.compressrequests = compressrequests
+        self.fasthash = fasthash
         self.count = 0
         self.total = 0
         self.cachepath = cachepath
         self.usecache = False
         self.maxretries = maxretries
         self.quietmode = quietmode
+        self.itemcache = itemcache
+        self.cachecompression = cachecompression
+        self.cachemaxbytes = cachemaxbytes
+        self.cachemaxentries = cachemaxentries
+        self.cachettl = cachettl
+        self.cacheseed = cacheseed
+        self.ratelimit = ratelimit
+        self.cache = None
+        self.limiter = _RateLimiter(ratelimit)
+        self.poolsize = poolsize
+        self.transport = _Transport(apikey, maxretries, poolsize, timeout=timeout, compress=compressrequests)
+        self.metrics = _Metrics()
+        self.countlock = threading.Lock()
+        self.inflight = {}
+        self.inflightlock = threading.Lock()
+        self.hooks = [self.printHook]
+        self.journalpath = journalpath
+        self.journal = None
+        if not journalpath == None:
+            self.journal = _Journal(journalpath)
         if not cachepath == None:
             self.usecache = True
             self.createCache()
-        self.listapis = self.apiAction('accountcontrol/listapis', 'GET', usecache=False)
+        self.catalogkey = hashlib.sha1(f'{baseurl}_{apikey}'.encode()).hexdigest()
+        self.catalogpath = catalogpath
+        if catalogpath is None:
+            # per user, next to the cache when there is one, never in the shared temp directory
+            if cachepath is not None:
+                catalogdir = os.path.dirname(os.path.abspath(cachepath))
+            else:
+                catalogdir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'cqazapipytools')
+            self.catalogpath = os.path.join(catalogdir, f'cqazapipytools-catalog-{self.catalogkey}.json')
+        self.catalogttl = catalogttl
+        self.cataloglock = threading.RLock()
+        self._listapis = None
+        self.apiindex = None
         self.failedrequests = []
 
     def __enter__(self):
         return self
+
+    @property
+    def listapis(self):
+        if self._listapis is None:
+            self._loadCatalog()
+        return self._listapis
+
+    @listapis.setter
+    def listapis(self, listapis):
+        apiindex = {}
+        for a in listapis or []:
+            apiindex.setdefault((a['api'], a['operation'], a['method']), a)
+        self.apiindex = apiindex
+        self._listapis = listapis
+
+    def refreshCatalog(self):
+        self._loadCatalog(refresh=True)
+        return self._listapis
+
+    def _loadCatalog(self, refresh=False):
+        # loaded on first use, from the local catalog file when it is fresh enough
+        with self.cataloglock:
+            if self._listapis is not None and not refresh:
+                return
+            listapis = None if refresh else self._readCatalog()
+            if listapis is None:
+                listapis = self.apiAction('accountcontrol/listapis', 'GET', usecache=False)
+                if listapis is not None:
+                    self._writeCatalog(listapis)
+            self.listapis = listapis
+
+    def _readCatalog(self):
+        if not self.catalogttl:
+            return None
+        try:
+            with open(self.catalogpath, 'rb') as rfile:
+                # a file written by another user is ignored
+                if hasattr(os, 'getuid') and os.fstat(rfile.fileno()).st_uid != os.getuid():
+                    return None
+                catalog = _jsonLoads(rfile.read())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(catalog, dict) or catalog.get('key') != self.catalogkey or not isinstance(catalog.get('created'), (int, float)) or time.time() - catalog['created'] > self.catalogttl:
+            return None
+        listapis = catalog.get('listapis')
+        if not isinstance(listapis, list) or not all(self._validCatalogEntry(a) for a in listapis):
+            return None
+        return listapis
+
+    def _validCatalogEntry(self, a):
+        if not isinstance(a, dict) or not all(isinstance(a.get(k), str) for k in ['api', 'operation', 'method']):
+            return False
+        credits, maxrequest = a.get('credits'), a.get('maxrequest')
+        return (credits is None or (isinstance(credits, (int, float)) and not isinstance(credits, bool))) and (maxrequest is None or (isinstance(maxrequest, int) and not isinstance(maxrequest, bool)))
+
+    def _writeCatalog(self, listapis):
+        if not self.catalogttl:
+            return
+        temppath = f'{self.catalogpath}.{os.urandom(8).hex()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.catalogpath)), mode=0o700, exist_ok=True)
+            # readable by the owner only, and never written through an existing file or symlink
+            fd = os.open(temppath, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as wfile:
+                wfile.write(_jsonDumps({'key': self.catalogkey, 'created': time.time(), 'listapis': listapis}))
+            os.replace(temppath, self.catalogpath)
+        except OSError:
+            try:
+                os.remove(temppath)
+            except OSError:
+                pass
     
     def __exit__(self, exc_type, exc_value, traceback):
        self.closeSessions()
+       self.closeCache()
+       if not self.journal is None:
+           self.journal.close()
     
+    def addHook(self, hook):
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def printHook(self, event, data):
+        if self.quietmode and data.get('quiet'):
+            return
+        print(data['message'])
+
+    def loggingHook(self, event, data):
+        logger = logging.getLogger('cqazapipytools')
+        logger.log(logging.DEBUG if data.get('quiet') else logging.INFO, data['message'], extra={'event': event, 'data': data})
+
+    def log(self, message, event='log', quiet=False, **data):
+        if len(self.hooks) == 0:
+            return
+        data['message'] = message
+        data['quiet'] = quiet
+        for hook in list(self.hooks):
+            hook(event, data)
+
+    def getMetrics(self):
+        return self.metrics.snapshot()
+
+    def metricsText(self):
+        return self.metrics.prometheus()
+
+    def resetMetrics(self):
+        self.metrics.reset()
+
+    def _progress(self):
+        with self.countlock:
+            self.count += 1
+            return self.count
+
+    def _recordCredits(self, url, method):
+        endpoint = _endpointNamespace(url)[0].split('/')
+        if len(endpoint) >= 2 and endpoint[:2] != ['accountcontrol', 'listapis']:
+            credits = self.getCredits(endpoint[0], endpoint[1], method.upper())
+            if credits:
+                self.metrics.inc('credits', _endpointNamespace(url)[0], method, credits)
+
     def closeSessions(self):
-        while not self.sessionpool.empty():
-            try:
-                session = self.sessionpool.get_nowait()
-                session.close()
-            except queue.Empty:
-                break
+        self.transport.close()
  
     def clearCache(self):
-        if os.path.exists(self.cachepath):
-            os.remove(self.cachepath)
+        self.closeCache()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.cachepath + suffix):
+                os.remove(self.cachepath + suffix)
         self.createCache()
     
     def createCache(self):
-        with closing(sqlite3.connect(self.cachepath)) as cn:
+        self.cache = _CacheEngine(self.cachepath, self.cachecompression, maxbytes=self.cachemaxbytes, maxentries=self.cachemaxentries, ttl=self.cachettl, seed=self.cacheseed)
+
+    def closeCache(self):
+        if not self.cache is None:
+            self.cache.close()
+
+    def flushCache(self):
+        if not self.cache is None:
+            self.cache.flush()
+
+    def pruneCache(self):
+        return self.cache.prune()
 
-            cn = sqlite3.connect(self.cachepath)
-            cr = cn.cursor()
-            cr.execute('create table if not exists cache (hashvalue text, response text);')
-            cr.execute('create index if not exists hashvalue_index on cache (hashvalue);')
-            cn.commit()
+    def purgeCache(self, endpoint=None, vintage=None):
+        return self.cache.purge(endpoint, vintage)
+
+    def vacuumCache(self, full=False):
+        self.cache.vacuum(full)
+
+    def cacheStats(self):
+        return self.cache.stats()
+
+    def mergeCache(self, *paths):
+        merged = 0
+        for path in paths:
+            merged += self.cache.merge(path)
+        return merged
+
+    def exportCache(self, path, endpoint=None, vintage=None):
+        return self.cache.export(path, endpoint, vintage)
     
-    def saveCache(self, url, method, data, response):
-        with closing(sqlite3.connect(self.cachepath)) as cn:
-            cr = cn.cursor()
-            cr.execute("PRAGMA journal_mode=WAL;")
-            cr.execute('insert into cache (hashvalue,response) values (?,?);', (self.createHash(url,method,data), json.dumps(response),))
-            cn.commit()
+    def saveCache(self, url, method, data, response, raw=None, hashvalue=None):
+        if hashvalue is None:
+            hashvalue = self.createHash(url, method, data)
+        self.cache.put(hashvalue, response, url, raw)
     
     def saveCacheBulk(self, inputArray):
         if not inputArray or len(inputArray) == 0:
             return
-            
-        with closing(sqlite3.connect(self.cachepath)) as cn:
-            cr = cn.cursor()
-            cr.execute("PRAGMA journal_mode=WAL;")
-            
-            # Prepare batch data for bulk insert
-            batch_data = []
-            placeholders = []
-            for cache_entry in inputArray:
-                url, method, data, response = cache_entry
-                hash_value = self.createHash(url, method, data)
-                response_json = json.dumps(response)
-                batch_data.extend([hash_value, response_json])
-                placeholders.append("(?, ?)")
-            
-            # Single INSERT with multiple VALUES
-            query = f"INSERT INTO cache (hashvalue, response) VALUES {', '.join(placeholders)}"
-            cr.execute(query, batch_data)
-            cn.commit()
-
+        # the writer thread batches these into transactions
+        for update in inputArray:
+            url, method, data, response = update[:4]
+            hashvalue = update[5] if len(update) > 5 else self.createHash(url, method, data)
+            self.cache.put(hashvalue, response, url, update[4] if len(update) > 4 else None)
 
+    def loadCache(self, url, method, data, hashvalue=None):
+        if hashvalue is None:
+            hashvalue = self.createHash(url, method, data)
+        return self.cache.get(hashvalue)
 
-    def loadCache(self, url, method, data):
-        with closing(sqlite3.connect(self.cachepath)) as cn:
-            cr = cn.cursor()
-            cr.execute('select response from cache where hashvalue=?;', (self.createHash(url,method,data),))
-            r = cr.fetchone()
-            if not r is None:
-                return json.loads(r[0])
+    def loadCacheBulk(self, hashvalues):
+        return self.cache.getMany(hashvalues)
  
     def createHash(self, url, method, data):
+        if self.fasthash:
+            return hashlib.sha1(f"{url}_{method}_".encode() + _jsonDumps(data, sortkeys=True)).hexdigest()
         data_string = ""
         try:
             if isinstance(data, dict):
@@ -143,90 +1171,132 @@ class cqazapipytools:
         return hashlib.sha1(hashstr.encode()).hexdigest()
 
  
-    def apiAction(self, url, method = 'GET', in_json=None, usecache=None, noarray=False, bulkCacheUpdates=False, cacheUpdates=None, maxRetries=None):
+    def apiAction(self, url, method = 'GET', in_json=None, usecache=None, noarray=False, bulkCacheUpdates=False, cacheUpdates=None, maxRetries=None, checkcache=True):
         action_usecache = self.usecache
         if not usecache is None:
             action_usecache = usecache
-        if 'http' not in url:
-            url = f"{self.baseurl}{url}"
+        url = self._requestUrl(url, method, in_json)
         starttime = time.perf_counter()
         curr_maxretries = self.maxretries
         if maxRetries != None:
             curr_maxretries = maxRetries
-        adapter = HTTPAdapter(max_retries=Retry(
-            respect_retry_after_header=False,
-            total=curr_maxretries,
-            backoff_factor=1,
-            status_forcelist=[401, 403, 408, 500, 502, 503, 504], 
-            allowed_methods=['GET','POST']
-        ))
-        if self.sessionpool.empty():
-            session = requests.Session()
-            session.mount('https://', adapter)
-            if 'costquest' in url.lower():
-                session.headers['apikey'] = self.apikey
-        else:
-            session = self.sessionpool.get()
-        if method.upper() == 'GET':
-            if in_json is not None:
-                if len(in_json[0]) > 0:
-                    beginstr = '?'
-                    if '?' in url:
-                        beginstr = '&'
-                    url += f"{beginstr}{urllib.parse.urlencode(sorted(in_json[0].items()))}"
-        if action_usecache:
-            cache_result = self.loadCache(url, method, in_json)
+        endpoint = _endpointNamespace(url)[0]
+        # hashed once, the same key is used for the cache lookup, the single flight and the cache write
+        hashvalue = self.createHash(url, method, in_json) if action_usecache else None
+        if action_usecache and checkcache:
+            cache_result = self.loadCache(url, method, in_json, hashvalue)
             if not cache_result is None:
                 endtime = time.perf_counter()
-                self.count += 1
-                if not self.quietmode:
-                    print(f"API request ({self.count}/{self.total}) to CACHE {url} succeeded in {str(round(float(endtime-starttime),3))}s")
+                self.metrics.inc('cache_hits', endpoint, method)
+                self.log(f"API request ({self._progress()}/{self.total}) to CACHE {url} succeeded in {str(round(float(endtime-starttime),3))}s", 'request', quiet=True, url=url, method=method, source='cache', seconds=endtime-starttime)
                 return cache_result
-        if method.upper() == 'GET':
-            response = session.get(url)
+            self.metrics.inc('cache_misses', endpoint, method)
+        # identical requests already in flight on another thread share that response instead of being sent again,
+        # without the cache the serialized body is the key and nothing is hashed
+        flightkey = (hashvalue or (url, method.upper(), _jsonDumps(in_json)), noarray)
+        with self.inflightlock:
+            flight = self.inflight.get(flightkey)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[flightkey] = {'done': threading.Event()}
+        if not leader:
+            flight['done'].wait()
+            if 'error' in flight:
+                raise flight['error']
+            self.metrics.inc('coalesced', endpoint, method)
+            return flight['result']
+        try:
+            flight['result'] = self._send(url, method, in_json, noarray, curr_maxretries, endpoint, starttime, hashvalue, bulkCacheUpdates, cacheUpdates)
+            return flight['result']
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self.inflightlock:
+                del self.inflight[flightkey]
+            flight['done'].set()
+
+    def _send(self, url, method, in_json, noarray, curr_maxretries, endpoint, starttime, hashvalue, bulkCacheUpdates, cacheUpdates):
+        body = None
         if method.upper() == 'POST':
-            if noarray:
-                response = session.post(url, json=in_json[0])
-            else:
-                response = session.post(url, json=in_json)
-        if response.status_code == 429:
+            body = in_json[0] if noarray else in_json
+        while True:
+            self.limiter.acquire()
+            success = False
+            requeststart = time.perf_counter()
+            try:
+                with self.transport.session(curr_maxretries) as session:
+                    response = self.transport.request(session, method, url, body)
+                success = response.status_code != 429
+            except requests.exceptions.RequestException:
+                self.metrics.inc('errors', endpoint, method)
+                raise
+            finally:
+                self.limiter.release(success)
+            self._recordResponse(endpoint, method, response, time.perf_counter() - requeststart)
+            if response.status_code != 429:
+                break
             retryafter = int(response.headers.get('Retry-After', 60)) + 1
-            print(f'Rate limiting encountered, waiting for {retryafter}s')
-            time.sleep(retryafter)
-            if method.upper() == 'GET':
-                return self.apiAction(url, 'GET')
-            if method.upper() == 'POST':
-                if noarray:
-                    return self.apiAction(url, method, in_json[0])
-                else:
-                    return self.apiAction(url, method, in_json)
-        elif response.status_code >= 400:
-            print(f'API request failed with status code {response.status_code} and message {response.text} \n url: {url} \n method: {method} \n body: {in_json}')
+            self.metrics.inc('ratelimit_waits', endpoint, method)
+            self.metrics.inc('ratelimit_wait_seconds', endpoint, method, retryafter)
+            self.log(f'Rate limiting encountered, pausing requests for {retryafter}s', 'ratelimit', url=url, method=method, retryafter=retryafter)
+            # pauses every worker sharing this client, the request is retried once the pause is over
+            self.limiter.throttle(retryafter)
+        if response.status_code >= 400:
+            self.metrics.inc('errors', endpoint, method)
+            self.log(f'API request failed with status code {response.status_code} and message {response.text} \n url: {url} \n method: {method} \n body: {in_json}', 'request_failed', url=url, method=method, status=response.status_code)
         else:
-            self.sessionpool.put(session)
             endtime = time.perf_counter()
-            self.count += 1
-            if not self.quietmode:
-                print(f"API request ({self.count}/{self.total}) to {method.upper()} {url} succeeded in {str(round(float(endtime-starttime),3))}s")
-            if action_usecache:
+            self._recordCredits(url, method)
+            self.log(f"API request ({self._progress()}/{self.total}) to {method.upper()} {url} succeeded in {str(round(float(endtime-starttime),3))}s", 'request', quiet=True, url=url, method=method, source='api', seconds=endtime-starttime)
+            # decoded once, the cache keeps the raw bytes
+            result = _jsonLoads(response.content)
+            if hashvalue is not None:
                 if bulkCacheUpdates:
-                    cacheUpdates.append((url, method, in_json, response.json()))
+                    cacheUpdates.append((url, method, in_json, result, response.content, hashvalue))
                 else:
-                    self.saveCache(url, method, in_json, response.json())
-            return response.json()
+                    self.saveCache(url, method, in_json, result, response.content, hashvalue)
+            return result
+
+    def _clientTimeout(self):
+        connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+        return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
 
-    def bulkApiAction(self, url, method, in_list, maxsize, workers=4, usecache=None, noarray=False, bulkCacheUpdates=False, ignoreerrors=False):
+    def _recordResponse(self, endpoint, method, response, seconds):
+        self.metrics.inc('requests', endpoint, method)
+        self.metrics.observe(endpoint, method, seconds)
+        body = response.request.body if response.request is not None else None
+        if body is not None:
+            self.metrics.inc('bytes_sent', endpoint, method, len(body))
+        self.metrics.inc('bytes_received', endpoint, method, len(response.content))
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and len(retries.history) > 0:
+            self.metrics.inc('retries', endpoint, method, len(retries.history))
+
+    def bulkApiAction(self, url, method, in_list, maxsize, workers=4, usecache=None, noarray=False, bulkCacheUpdates=False, ignoreerrors=False, itemkey=None, usejournal=None, dedupkey=None, adaptive=False):
         bulk_starttime = time.perf_counter()
         self.count = 0
         self.failedrequests = []
         results = []
         cacheUpdates = []
+        itemtotal = len(in_list)
 
         if len(in_list) == 0:
             return results
         if method == 'GET':
             maxsize = 1
-        if maxsize is not None and len(in_list) < maxsize:
+        action_usecache = self.usecache if usecache is None else usecache
+        itemmode = action_usecache and itemkey is not None and method.upper() == 'POST' and not noarray
+        duplicates = {}
+        if dedupkey is not None:
+            if maxsize is None:
+                raise Exception("bulkApiAction() requires maxsize when dedupkey is used")
+            in_list, duplicates = self._dedupItems(in_list, dedupkey)
+        adaptive = adaptive and maxsize is not None and maxsize > 1 and not noarray
+        # a list of urls sends the same in_list to each of them from one shared pool
+        urls = url if isinstance(url, list) else [url]
+        if len(urls) == 1 and maxsize is not None and len(in_list) < maxsize and not itemmode and not adaptive:
+            url = urls[0]
             try:
                 results = self.apiAction(url, method, in_list, usecache=usecache, bulkCacheUpdates=bulkCacheUpdates, cacheUpdates=cacheUpdates)
             except requests.exceptions.RequestException as e:
@@ -235,125 +1305,651 @@ class cqazapipytools:
                 self.failedrequests.append({'url': url, 'method': method, 'body': in_list, 'error': str(e)})
                 results = []
         else:
-            if maxsize is not None:
-                chunks = self.chunkList(in_list, maxsize)
+            jobid = None
+            pending = None
+            sizer = None
+            # adaptive chunks are not reproducible, so they can't be journaled or looked up in the cache up front.
+            # journaled results are stored responses, they are not replayed when the caller bypasses the cache
+            if not self.journal is None and usejournal != False and usecache != False and not adaptive:
+                jobid = self.createHash('|'.join(self._requestUrl(u, method) for u in urls), f'{method.upper()}_JOB_{maxsize}_{itemkey}_{noarray}', in_list)
+                pending = self.journal.resume(jobid, results)
+                if not pending is None:
+                    self.total = len(pending)
+                    self.log(f"Resuming journaled job {jobid} with {len(pending)} requests remaining", 'journal', jobid=jobid, remaining=len(pending))
+            if adaptive:
+                work = deque()
+                for u in urls:
+                    if itemmode:
+                        for misses in self._resolveCachedItems(u, method, [in_list], None, results):
+                            work.extend((u, item) for item in misses)
+                    else:
+                        work.extend((u, item) for item in in_list)
+                sizer = _ChunkSizer(maxsize, workers, len(work), len(_jsonDumps(in_list[:100])) / min(100, len(in_list)))
+                self.total = math.ceil(len(work) / sizer.size)
+                worklock = threading.Lock()
+                def nextchunk():
+                    with worklock:
+                        if len(work) == 0:
+                            return None
+                        size = sizer.next()
+                        chunkurl = work[0][0]
+                        chunk = []
+                        while len(work) > 0 and len(chunk) < size and work[0][0] == chunkurl:
+                            chunk.append(work.popleft()[1])
+                        return None, chunkurl, chunk
             else:
-                chunks = in_list
-            self.total = len(chunks)
-            q = queue.Queue()
-            for chunk in chunks:
-                q.put(chunk)
+                if pending is None:
+                    pending = []
+                    self.total = 0
+                    for u in urls:
+                        if itemmode:
+                            chunks = self._resolveCachedItems(u, method, in_list, maxsize, results)
+                        elif maxsize is not None:
+                            chunks = self.chunkList(in_list, maxsize)
+                        else:
+                            chunks = in_list
+                        self.total += len(chunks)
+                        if action_usecache and not itemmode:
+                            chunks = self._resolveCachedChunks(u, method, chunks, results)
+                        pending.extend((u, chunk) for chunk in chunks)
+                    pending = [(idx, u, chunk) for idx, (u, chunk) in enumerate(pending)]
+                    if not jobid is None:
+                        self.journal.create(jobid, '|'.join(urls), method, pending, results)
+                q = queue.Queue()
+                for p in pending:
+                    q.put(p)
+                def nextchunk():
+                    try:
+                        return q.get(block=False)
+                    except queue.Empty:
+                        return None
             def worker():
                 while True:
+                    item = nextchunk()
+                    if item is None:
+                        break
+                    idx, chunkurl, chunk = item
+                    requeststart = time.perf_counter()
                     try:
-                        chunk = q.get(block=False)
-                        try:
-                            result = self.apiAction(url, method, chunk, usecache=usecache, noarray=noarray, bulkCacheUpdates=bulkCacheUpdates, cacheUpdates=cacheUpdates)
-                        except requests.exceptions.RequestException as e:
-                            if not ignoreerrors:
-                                raise
-                            self.failedrequests.append({'url': url, 'method': method, 'body': chunk, 'error': str(e)})
-                            q.task_done()
-                            continue
-                        if isinstance(result, list):
-                            results.extend(result)
+                        if itemmode:
+                            result = self.apiAction(chunkurl, method, chunk, usecache=False)
+                            self._saveCachedItems(chunkurl, method, chunk, result, itemkey, bulkCacheUpdates, cacheUpdates)
                         else:
-                            results.append(result)
-                        q.task_done()
-                    except queue.Empty:
-                        break
-            with ThreadPoolExecutor(max_workers=workers) as executor:
+                            result = self.apiAction(chunkurl, method, chunk, usecache=usecache, noarray=noarray, bulkCacheUpdates=bulkCacheUpdates, cacheUpdates=cacheUpdates, checkcache=adaptive)
+                    except requests.exceptions.RequestException as e:
+                        if not sizer is None:
+                            sizer.failure()
+                        if not jobid is None:
+                            self.journal.fail(jobid, idx, str(e))
+                        if not ignoreerrors:
+                            raise
+                        self.failedrequests.append({'url': chunkurl, 'method': method, 'body': chunk, 'error': str(e)})
+                        continue
+                    if not sizer is None:
+                        sizer.observe(len(chunk), time.perf_counter() - requeststart)
+                    if not jobid is None:
+                        self.journal.complete(jobid, idx, result)
+                    if isinstance(result, list):
+                        results.extend(result)
+                    else:
+                        results.append(result)
+            with self.limiter.concurrency(workers), ThreadPoolExecutor(max_workers=workers) as executor:
                 futures = [executor.submit(worker) for _ in range(workers)]
                 for future in as_completed(futures):
                     future.result()
+            if not jobid is None and len(self.failedrequests) == 0:
+                self.journal.finish(jobid)
         self.total = 0
+        results = self._fanOut(results, dedupkey, duplicates)
 
         # Write all cache updates in bulk if enabled
         if bulkCacheUpdates and len(cacheUpdates) > 0:
             self.saveCacheBulk(cacheUpdates)
 
         bulk_endtime = time.perf_counter()
-        print(f"API bulk request for {len(in_list)} items to {method.upper()} {url} succeeded in {str(round(float(bulk_endtime-bulk_starttime),3))}s")
+        self.log(f"API bulk request for {itemtotal} items to {method.upper()} {url} succeeded in {str(round(float(bulk_endtime-bulk_starttime),3))}s", 'bulk', url=url, method=method, items=itemtotal, seconds=bulk_endtime-bulk_starttime)
+        return results
+
+    def _dedupItems(self, in_list, dedupkey):
+        # items that only differ by dedupkey are sent once, duplicates maps the key that is sent to the items left out
+        unique = []
+        first = {}
+        duplicates = {}
+        for item in in_list:
+            if not isinstance(item, dict) or item.get(dedupkey) is None:
+                unique.append(item)
+                continue
+            signature = _jsonDumps({k: v for k, v in item.items() if k != dedupkey}, sortkeys=True)
+            key = first.get(signature)
+            if key is None:
+                first[signature] = item[dedupkey]
+                unique.append(item)
+            else:
+                duplicates.setdefault(str(key), []).append(item)
+        if len(duplicates) > 0:
+            # a key sent for more than one distinct item can't be fanned out, its duplicates are sent as they are
+            keycounts = {}
+            for item in unique:
+                if isinstance(item, dict) and item.get(dedupkey) is not None:
+                    keycounts[str(item[dedupkey])] = keycounts.get(str(item[dedupkey]), 0) + 1
+            for key in [k for k in duplicates if keycounts[k] > 1]:
+                unique.extend(duplicates.pop(key))
+            self.metrics.inc('deduplicated', value=sum(len(d) for d in duplicates.values()))
+        return unique, duplicates
+
+    def _fanOut(self, results, dedupkey, duplicates):
+        if len(duplicates) == 0:
+            return results
+        out = []
+        for r in results:
+            out.append(r)
+            if isinstance(r, dict) and r.get(dedupkey) is not None:
+                for item in duplicates.get(str(r[dedupkey]), []):
+                    out.append(dict(r, **{dedupkey: item[dedupkey]}))
+        return out
+
+    def replayFailedRequests(self, workers=4, ignoreerrors=True):
+        # re-run failedrequests from the last bulk request as a new bulk request per url and method
+        failed = self.failedrequests
+        groups = {}
+        for f in failed:
+            groups.setdefault((f['url'], f['method']), []).append(f['body'])
+        results = []
+        remaining = []
+        for (url, method), bodies in groups.items():
+            if method.upper() == 'GET':
+                results.extend(self.bulkApiAction(url, method, [b[0] for b in bodies], 1, workers, ignoreerrors=ignoreerrors))
+            else:
+                results.extend(self.bulkApiAction(url, method, bodies, None, workers, ignoreerrors=ignoreerrors))
+            remaining.extend(self.failedrequests)
+        self.failedrequests = remaining
+        return results
+
+    def journalJobs(self):
+        return self.journal.jobs()
+
+    def clearJournal(self, jobid=None):
+        self.journal.delete(jobid)
+
+    def iterBulkApiAction(self, url, method, in_iter, maxsize, workers=4, usecache=None, noarray=False, ignoreerrors=False, ordered=False, inflight=None, itemkey=None):
+        bulk_starttime = time.perf_counter()
+        self.count = 0
+        self.failedrequests = []
+        if method == 'GET':
+            maxsize = 1
+        if inflight is None:
+            inflight = workers * 2
+        action_usecache = self.usecache if usecache is None else usecache
+        itemmode = action_usecache and itemkey is not None and method.upper() == 'POST' and not noarray
+        itemcount = [0]
+        def counted():
+            for item in in_iter:
+                itemcount[0] += 1 if maxsize is not None else len(item)
+                yield item
+        if maxsize is not None:
+            chunks = self.chunkIter(counted(), maxsize)
+        else:
+            chunks = counted()
+        def run(chunk):
+            results = []
+            try:
+                if itemmode:
+                    for misses in self._resolveCachedItems(url, method, [chunk], None, results):
+                        result = self.apiAction(url, method, misses, usecache=False)
+                        self._saveCachedItems(url, method, misses, result, itemkey)
+                        results.extend(result if isinstance(result, list) else [result])
+                else:
+                    result = self.apiAction(url, method, chunk, usecache=usecache, noarray=noarray)
+                    results.extend(result if isinstance(result, list) else [result])
+            except requests.exceptions.RequestException as e:
+                if not ignoreerrors:
+                    raise
+                self.failedrequests.append({'url': url, 'method': method, 'body': chunk, 'error': str(e)})
+            return results
+        # only `inflight` chunks are ever submitted at once so memory stays flat however large the input is
+        with self.limiter.concurrency(workers):
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = deque()
+                for chunk in itertools.islice(chunks, inflight):
+                    futures.append(executor.submit(run, chunk))
+                while len(futures) > 0:
+                    if ordered:
+                        done = [futures.popleft()]
+                    else:
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            futures.remove(future)
+                    for future in done:
+                        for result in future.result():
+                            yield result
+                        for chunk in itertools.islice(chunks, 1):
+                            futures.append(executor.submit(run, chunk))
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        bulk_endtime = time.perf_counter()
+        self.log(f"API bulk request for {itemcount[0]} items to {method.upper()} {url} succeeded in {str(round(float(bulk_endtime-bulk_starttime),3))}s", 'bulk', url=url, method=method, items=itemcount[0], seconds=bulk_endtime-bulk_starttime)
+
+    def _requestUrl(self, url, method, in_json=None):
+        if 'http' not in url:
+            url = f"{self.baseurl}{url}"
+        if method.upper() == 'GET':
+            if in_json is not None:
+                if len(in_json[0]) > 0:
+                    beginstr = '?'
+                    if '?' in url:
+                        beginstr = '&'
+                    url += f"{beginstr}{urllib.parse.urlencode(sorted(in_json[0].items()))}"
+        return url
+
+    def _resolveCachedChunks(self, url, method, chunks, results):
+        # look up every chunk in one pass, add the hits to results and hand back only the misses
+        hashes = [self.createHash(self._requestUrl(url, method, c), method, c) for c in chunks]
+        cached = self.loadCacheBulk(hashes)
+        misses = []
+        for chunk, hashvalue in zip(chunks, hashes):
+            if hashvalue in cached:
+                result = cached[hashvalue]
+                if isinstance(result, list):
+                    results.extend(result)
+                else:
+                    results.append(result)
+            else:
+                misses.append(chunk)
+        with self.countlock:
+            self.count += len(chunks) - len(misses)
+        endpoint = _endpointNamespace(self._requestUrl(url, method))[0]
+        self.metrics.inc('cache_hits', endpoint, method, len(chunks) - len(misses))
+        self.metrics.inc('cache_misses', endpoint, method, len(misses))
+        self.log(f"Resolved {len(chunks) - len(misses)} of {len(chunks)} requests from CACHE", 'cache', quiet=True, url=url, method=method, hits=len(chunks) - len(misses), total=len(chunks))
+        return misses
+
+    def _resolveCachedItems(self, url, method, in_list, maxsize, results):
+        # item level cache: every input item is looked up on its own and only uncached items are re-chunked
+        # when maxsize is None the input is already chunked (e.g. by h3 in locate) so that grouping is kept
+        url = self._requestUrl(url, method)
+        if maxsize is None:
+            groups = in_list
+        else:
+            groups = [in_list]
+        hashes = [[self.createHash(url, f'{method.upper()}_ITEM', i) for i in g] for g in groups]
+        cached = self.loadCacheBulk([h for hs in hashes for h in hs])
+        chunks = []
+        hits = 0
+        total = 0
+        for group, grouphashes in zip(groups, hashes):
+            misses = []
+            for item, hashvalue in zip(group, grouphashes):
+                total += 1
+                if hashvalue in cached:
+                    results.extend(cached[hashvalue])
+                    hits += 1
+                else:
+                    misses.append(item)
+            if maxsize is None:
+                if len(misses) > 0:
+                    chunks.append(misses)
+            else:
+                chunks.extend(self.chunkList(misses, maxsize))
+        endpoint = _endpointNamespace(url)[0]
+        self.metrics.inc('cache_hits', endpoint, method, hits)
+        self.metrics.inc('cache_misses', endpoint, method, total - hits)
+        self.log(f"Resolved {hits} of {total} items from CACHE", 'cache', quiet=True, url=url, method=method, hits=hits, total=total)
+        return chunks
+
+    def _saveCachedItems(self, url, method, chunk, result, itemkey, bulkCacheUpdates=False, cacheUpdates=None):
+        # split a chunk response back onto its input items by itemkey, items that can't be attributed are not cached
+        if not isinstance(result, list):
+            return
+        url = self._requestUrl(url, method)
+        rows = {}
+        for r in result:
+            if isinstance(r, dict) and r.get(itemkey) is not None:
+                rows.setdefault(str(r[itemkey]), []).append(r)
+        keycounts = {}
+        for item in chunk:
+            keyvalue = str(item.get(itemkey) if isinstance(item, dict) else item)
+            keycounts[keyvalue] = keycounts.get(keyvalue, 0) + 1
+        entries = []
+        for item in chunk:
+            keyvalue = str(item.get(itemkey) if isinstance(item, dict) else item)
+            if keyvalue in rows and keycounts[keyvalue] == 1:
+                entries.append((url, f'{method.upper()}_ITEM', item, rows[keyvalue]))
+        if bulkCacheUpdates:
+            cacheUpdates.extend(entries)
+        else:
+            self.saveCacheBulk(entries)
+
+    def _retryBackoff(self, attempt):
+        # mirrors urllib3 Retry(backoff_factor=1): no wait on the first retry, then 2s, 4s, ... capped at 120s
+        if attempt <= 1:
+            return 0
+        return min(120, 2 ** (attempt - 1))
+
+    async def aapiAction(self, url, method='GET', in_json=None, usecache=None, noarray=False, bulkCacheUpdates=False, cacheUpdates=None, maxRetries=None, session=None, checkcache=True):
+        if aiohttp is None:
+            raise Exception("aapiAction() requires the aiohttp package to be installed")
+        action_usecache = self.usecache
+        if not usecache is None:
+            action_usecache = usecache
+        url = self._requestUrl(url, method, in_json)
+        starttime = time.perf_counter()
+        curr_maxretries = self.maxretries
+        if maxRetries != None:
+            curr_maxretries = maxRetries
+        endpoint = _endpointNamespace(url)[0]
+        hashvalue = self.createHash(url, method, in_json) if action_usecache else None
+        if action_usecache and checkcache:
+            cache_result = self.loadCache(url, method, in_json, hashvalue)
+            if not cache_result is None:
+                endtime = time.perf_counter()
+                self.metrics.inc('cache_hits', endpoint, method)
+                self.log(f"API request ({self._progress()}/{self.total}) to CACHE {url} succeeded in {str(round(float(endtime-starttime),3))}s", 'request', quiet=True, url=url, method=method, source='cache', seconds=endtime-starttime)
+                return cache_result
+            self.metrics.inc('cache_misses', endpoint, method)
+        headers = {}
+        if 'costquest' in url.lower():
+            headers['apikey'] = self.apikey
+        data = None
+        if method.upper() == 'POST':
+            data = json.dumps(in_json[0] if noarray else in_json, allow_nan=False).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+            if self.compressrequests is not None and len(data) >= self.compressrequests:
+                data = gzip.compress(data, compresslevel=5)
+                headers['Content-Encoding'] = 'gzip'
+        owns_session = session is None
+        if owns_session:
+            session = aiohttp.ClientSession(timeout=self._clientTimeout())
+        try:
+            attempt = 0
+            while True:
+                await self.limiter.aacquire()
+                requeststart = time.perf_counter()
+                try:
+                    async with session.request(method.upper(), url, data=data, headers=headers) as response:
+                        status = response.status
+                        retryafter = response.headers.get('Retry-After', 60)
+                        content = await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    attempt += 1
+                    if attempt > curr_maxretries:
+                        self.metrics.inc('errors', endpoint, method)
+                        raise requests.exceptions.ConnectionError(f"Max retries exceeded with url: {url} ({e})")
+                    self.metrics.inc('retries', endpoint, method)
+                    await asyncio.sleep(self._retryBackoff(attempt))
+                    continue
+                self.metrics.inc('requests', endpoint, method)
+                self.metrics.observe(endpoint, method, time.perf_counter() - requeststart)
+                if data is not None:
+                    self.metrics.inc('bytes_sent', endpoint, method, len(data))
+                self.metrics.inc('bytes_received', endpoint, method, len(content))
+                if status == 429:
+                    retryafter = int(retryafter) + 1
+                    self.metrics.inc('ratelimit_waits', endpoint, method)
+                    self.metrics.inc('ratelimit_wait_seconds', endpoint, method, retryafter)
+                    self.log(f'Rate limiting encountered, pausing requests for {retryafter}s', 'ratelimit', url=url, method=method, retryafter=retryafter)
+                    self.limiter.throttle(retryafter)
+                    continue
+                if status in [401, 403, 408, 500, 502, 503, 504]:
+                    attempt += 1
+                    if attempt > curr_maxretries:
+                        self.metrics.inc('errors', endpoint, method)
+                        raise requests.exceptions.RetryError(f"Max retries exceeded with url: {url} (too many {status} error responses)")
+                    self.metrics.inc('retries', endpoint, method)
+                    await asyncio.sleep(self._retryBackoff(attempt))
+                    continue
+                break
+        finally:
+            if owns_session:
+                await session.close()
+        if status >= 400:
+            self.metrics.inc('errors', endpoint, method)
+            self.log(f'API request failed with status code {status} and message {content.decode("utf-8", "replace")} \n url: {url} \n method: {method} \n body: {in_json}', 'request_failed', url=url, method=method, status=status)
+            return None
+        result = _jsonLoads(content)
+        endtime = time.perf_counter()
+        if self.apiindex is None:
+            # the catalog is fetched with a blocking request, keep it off the event loop
+            await asyncio.to_thread(self._loadCatalog)
+        self._recordCredits(url, method)
+        self.log(f"API request ({self._progress()}/{self.total}) to {method.upper()} {url} succeeded in {str(round(float(endtime-starttime),3))}s", 'request', quiet=True, url=url, method=method, source='api', seconds=endtime-starttime)
+        if action_usecache:
+            if bulkCacheUpdates:
+                cacheUpdates.append((url, method, in_json, result, content, hashvalue))
+            else:
+                self.saveCache(url, method, in_json, result, content, hashvalue)
+        return result
+
+    async def abulkApiAction(self, url, method, in_list, maxsize, concurrency=100, usecache=None, noarray=False, bulkCacheUpdates=False, ignoreerrors=False, itemkey=None):
+        if aiohttp is None:
+            raise Exception("abulkApiAction() requires the aiohttp package to be installed")
+        bulk_starttime = time.perf_counter()
+        self.count = 0
+        self.failedrequests = []
+        results = []
+        cacheUpdates = []
+
+        if len(in_list) == 0:
+            return results
+        if method == 'GET':
+            maxsize = 1
+        action_usecache = self.usecache if usecache is None else usecache
+        itemmode = action_usecache and itemkey is not None and method.upper() == 'POST' and not noarray
+        # loaded before the requests start so no worker blocks the event loop on it
+        await asyncio.to_thread(self._loadCatalog)
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency), timeout=self._clientTimeout()) as session:
+            if maxsize is not None and len(in_list) < maxsize and not itemmode:
+                try:
+                    results = await self.aapiAction(url, method, in_list, usecache=usecache, bulkCacheUpdates=bulkCacheUpdates, cacheUpdates=cacheUpdates, session=session)
+                except requests.exceptions.RequestException as e:
+                    if not ignoreerrors:
+                        raise
+                    self.failedrequests.append({'url': url, 'method': method, 'body': in_list, 'error': str(e)})
+                    results = []
+            else:
+                if itemmode:
+                    chunks = self._resolveCachedItems(url, method, in_list, maxsize, results)
+                elif maxsize is not None:
+                    chunks = self.chunkList(in_list, maxsize)
+                else:
+                    chunks = in_list
+                self.total = len(chunks)
+                if action_usecache and not itemmode:
+                    chunks = self._resolveCachedChunks(url, method, chunks, results)
+                pending = iter(chunks)
+                semaphore = asyncio.Semaphore(concurrency)
+                async def worker():
+                    # each worker pulls the next chunk from the shared iterator so only `concurrency` requests exist at once
+                    for chunk in pending:
+                        async with semaphore:
+                            try:
+                                if itemmode:
+                                    result = await self.aapiAction(url, method, chunk, usecache=False, session=session)
+                                    self._saveCachedItems(url, method, chunk, result, itemkey, bulkCacheUpdates, cacheUpdates)
+                                else:
+                                    result = await self.aapiAction(url, method, chunk, usecache=usecache, noarray=noarray, bulkCacheUpdates=bulkCacheUpdates, cacheUpdates=cacheUpdates, session=session, checkcache=False)
+                            except requests.exceptions.RequestException as e:
+                                if not ignoreerrors:
+                                    raise
+                                self.failedrequests.append({'url': url, 'method': method, 'body': chunk, 'error': str(e)})
+                                continue
+                        if isinstance(result, list):
+                            results.extend(result)
+                        else:
+                            results.append(result)
+                tasks = [asyncio.ensure_future(worker()) for _ in range(max(1, min(concurrency, len(chunks))))]
+                try:
+                    await asyncio.gather(*tasks)
+                except BaseException:
+                    for t in tasks:
+                        t.cancel()
+                    raise
+        self.total = 0
+
+        # Write all cache updates in bulk if enabled
+        if bulkCacheUpdates and len(cacheUpdates) > 0:
+            self.saveCacheBulk(cacheUpdates)
+
+        bulk_endtime = time.perf_counter()
+        self.log(f"API async bulk request for {len(in_list)} items to {method.upper()} {url} succeeded in {str(round(float(bulk_endtime-bulk_starttime),3))}s", 'bulk', url=url, method=method, items=len(in_list), seconds=bulk_endtime-bulk_starttime)
         return results
 
     def chunkList(self, list, size):
         return [list[i:i + size] for i in range(0, len(list), size)]
 
+    def chunkIter(self, in_iter, size):
+        iterator = iter(in_iter)
+        while True:
+            chunk = list(itertools.islice(iterator, size))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
 
     def mergeList(self, in_list1, in_list2, key_name):
-        keys2 = {}
-        for l in in_list2:
-            if str(l[key_name]) in keys2:
-                raise Exception("mergeList() requires unique keys in in_list2")
-            keys2[str(l[key_name])] = l
-        for l in in_list1:
-            if str(key_name) in l.keys():
-                if l[key_name] != None:
-                    if str(l[key_name]) in keys2:
-                        l2 = keys2[str(l[key_name])]
-                        for k2 in l2.keys():
-                            if k2 not in l.keys():
-                                l[k2] = keys2[str(l[key_name])][k2]
-        return in_list1
-    
-    def transformList(self, in_list, mode, keys):
-        out_list = copy.deepcopy(in_list)
+        return self.joinList(in_list1, [in_list2], key_name)
+
+    def joinList(self, in_list, right_lists, key_name):
+        # one index over every right hand list, then a single pass over in_list
+        if len(right_lists) > 0 and isinstance(right_lists[0], dict):
+            right_lists = [right_lists]
+        index = {}
+        for right in right_lists:
+            seen = set()
+            for r in right:
+                key = r[key_name]
+                key = key if type(key) is str else str(key)
+                if key in seen:
+                    raise Exception("joinList() requires unique keys in each right hand list")
+                seen.add(key)
+                index.setdefault(key, []).append(r)
+        for l in in_list:
+            key = l.get(key_name)
+            if key is None:
+                continue
+            matches = index.get(key if type(key) is str else str(key))
+            if matches is None:
+                continue
+            for r in matches:
+                for k2, v2 in r.items():
+                    if k2 not in l:
+                        l[k2] = v2
+        return in_list
+
+    def transformList(self, in_list, mode, keys, inplace=False):
+        # builds shallow copies of each dict, nested values are shared with in_list. inplace=True modifies in_list itself
         mode = mode.lower()
-        if mode == 'select':
-            for il in out_list:
-                for k in list(il.keys()):
-                    if not k in keys:
-                        il.pop(k)
-        elif mode == 'drop':
-            for il in out_list:
-                for k in list(il.keys()):
-                    if k in keys:
-                        il.pop(k)
-        elif mode == 'rename':
+        if mode == 'rename':
             if type(keys) != dict:
                 raise Exception("transformList() requires key value pairs of type dict for mode=rename")
-            for il in out_list:
+        elif mode not in ('select', 'drop'):
+            raise Exception("Unsupported mode")
+        keyset = set(keys)
+        if inplace:
+            for il in in_list:
                 for k in list(il.keys()):
-                    if k in keys.keys():
+                    if mode == 'select' and k not in keyset:
+                        il.pop(k)
+                    elif mode == 'drop' and k in keyset:
+                        il.pop(k)
+                    elif mode == 'rename' and k in keyset:
                         il[keys[k]] = il.pop(k)
-        else:
-            raise Exception("Unsupported mode")
+            return in_list
+        if mode == 'select':
+            return [{k: v for k, v in il.items() if k in keyset} for il in in_list]
+        if mode == 'drop':
+            return [{k: v for k, v in il.items() if k not in keyset} for il in in_list]
+        out_list = []
+        for il in in_list:
+            # renamed keys move to the end, as they did when renamed in place
+            ol = {k: v for k, v in il.items() if k not in keyset}
+            for k, v in il.items():
+                if k in keyset:
+                    ol[keys[k]] = v
+            out_list.append(ol)
         return out_list
 
+    def toColumns(self, in_list, fields=None, usenumpy=False):
+        if usenumpy and numpy is None:
+            raise Exception("toColumns() with usenumpy=True requires the numpy package to be installed")
+        if fields is None:
+            fields = {}
+            for il in in_list:
+                fields.update(dict.fromkeys(il))
+        columns = {f: [] for f in fields}
+        for il in in_list:
+            for f, column in columns.items():
+                column.append(il.get(f))
+        if usenumpy:
+            columns = {f: numpy.asarray(column) for f, column in columns.items()}
+        return columns
+
+    def fromColumns(self, columns):
+        fields = list(columns)
+        values = [c.tolist() if hasattr(c, 'tolist') else c for c in columns.values()]
+        return [dict(zip(fields, row)) for row in zip(*values)]
+
     def flattenList(self, in_list):
         return [flatten(il) for il in in_list]
 
     def csvRead(self, filepath):
-        data = []
+        data = list(self._csvRows(filepath))
+        self.log(f"Read {len(data)} rows from file {filepath}", 'file', path=filepath, rows=len(data))
+        return data
+
+    def iterCsvRead(self, filepath):
         count = 0
+        for row in self._csvRows(filepath):
+            count += 1
+            yield row
+        self.log(f"Read {count} rows from file {filepath}", 'file', path=filepath, rows=count)
+
+    def _csvRows(self, filepath):
         with open(filepath, 'r', newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                data.append(row)
-                count += 1
-        print(f"Read {len(data)} rows from file {filepath}")
-        return data
+            yield from csv.DictReader(csvfile)
 
     def csvWrite(self, filepath, in_list, fields = None, flatten = True):
-        if flatten:
-            flattened = self.flattenList(in_list)
-        else:
-            flattened = in_list
-        if fields == None and flatten == True:
-            fields = []
-            for f in flattened:
-                for k in f.keys():
-                    if k not in fields:
-                        fields.append(k)
-        with open(filepath, 'w', newline='', encoding="utf-8") as csvfile:
-            if fields != None:
-                fieldnames = fields
+        rows = self._flattenRows(in_list) if flatten else in_list
+        spool = None
+        if fields == None:
+            # an ordered set of columns in first seen order, found in a first pass over the rows
+            fields = {}
+            if isinstance(in_list, (list, tuple)):
+                for row in rows:
+                    fields.update(dict.fromkeys(row))
+                rows = self._flattenRows(in_list) if flatten else in_list
             else:
-                fieldnames = sorted(fields, reverse=True)
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(flattened)
-        print(f"Wrote {len(flattened)} rows to file {filepath}")
+                # one shot iterators are spooled to a temporary file so memory use stays flat
+                spool = tempfile.TemporaryFile()
+                for row in rows:
+                    fields.update(dict.fromkeys(row))
+                    pickle.dump(row, spool, pickle.HIGHEST_PROTOCOL)
+                spool.seek(0)
+                rows = self._unspool(spool)
+            fields = list(fields)
+        count = 0
+        try:
+            with open(filepath, 'w', newline='', encoding="utf-8") as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=fields)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+        finally:
+            if spool is not None:
+                spool.close()
+        self.log(f"Wrote {count} rows to file {filepath}", 'file', path=filepath, rows=count)
+
+    def _flattenRows(self, in_iter):
+        for row in in_iter:
+            yield flatten(row)
+
+    def _unspool(self, spool):
+        while True:
+            try:
+                yield pickle.load(spool)
+            except EOFError:
+                return
 
     def jsonRead(self, filepath):
         with open(filepath, 'r', newline='') as rfile:
@@ -361,18 +1957,187 @@ class cqazapipytools:
 
     def jsonWrite(self, filepath, in_json):
         with open(filepath, 'w', newline='') as wfile:
-            json.dump(in_json, wfile)
-        print(f"Wrote data to file {filepath}")
+            if isinstance(in_json, (dict, list, tuple, str, int, float, bool)) or in_json is None:
+                json.dump(in_json, wfile)
+            else:
+                # iterators are written as an array one item at a time
+                wfile.write('[')
+                for i, item in enumerate(in_json):
+                    if i > 0:
+                        wfile.write(', ')
+                    json.dump(item, wfile)
+                wfile.write(']')
+        self.log(f"Wrote data to file {filepath}", 'file', path=filepath)
+
+    def jsonlRead(self, filepath):
+        data = list(self._jsonlRows(filepath))
+        self.log(f"Read {len(data)} rows from file {filepath}", 'file', path=filepath, rows=len(data))
+        return data
+
+    def iterJsonlRead(self, filepath):
+        count = 0
+        for row in self._jsonlRows(filepath):
+            count += 1
+            yield row
+        self.log(f"Read {count} rows from file {filepath}", 'file', path=filepath, rows=count)
+
+    def _jsonlRows(self, filepath):
+        with open(filepath, 'rb') as rfile:
+            for line in rfile:
+                if line.strip():
+                    yield _jsonLoads(line)
+
+    def jsonlWrite(self, filepath, in_iter):
+        count = 0
+        with open(filepath, 'wb') as wfile:
+            for item in in_iter:
+                wfile.write(_jsonDumps(item) + b'\n')
+                count += 1
+        self.log(f"Wrote {count} rows to file {filepath}", 'file', path=filepath, rows=count)
+
+    def runSharded(self, operation, in_data, jobdir, vintage, shards=None, processes=None, claimttl=300, block=True, cachedir=None, **kwargs):
+        # any number of hosts can run this against the same jobdir, shards are claimed with lock files so each runs once
+        if operation not in ('match', 'attach', 'locate'):
+            raise Exception("runSharded() supports the match, attach and locate operations")
+        pcs = time.perf_counter()
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if shards is None:
+            shards = processes * 4
+        os.makedirs(jobdir, exist_ok=True)
+        manifest = self._shardManifest(jobdir, operation, vintage, in_data, shards, kwargs)
+        config = {
+            'apikey': self.apikey, 'baseurl': self.baseurl, 'maxretries': self.maxretries, 'quietmode': self.quietmode,
+            'itemcache': self.itemcache, 'cachecompression': self.cachecompression, 'timeout': self.timeout,
+            'compressrequests': self.compressrequests, 'fasthash': self.fasthash, 'catalogpath': self.catalogpath,
+            'catalogttl': self.catalogttl, 'poolsize': self.poolsize, 'ratelimit': self.ratelimit / processes if self.ratelimit else None,
+        }
+        if not self.cache is None:
+            # shards read the main cache but write their own, mergeShardCaches() brings those back afterwards
+            self.cache.flush()
+        cachedir = jobdir if cachedir is None else cachedir
+        claimed = 0
+        while True:
+            # shards that are unclaimed, or whose claim went stale because its host died, are run here
+            pending = [i for i in range(manifest['shards']) if not os.path.exists(_shardPath(jobdir, i, 'result.jsonl')) and _claimAvailable(jobdir, i, claimttl)]
+            if len(pending) > 0:
+                with ProcessPoolExecutor(max_workers=min(processes, len(pending)), mp_context=multiprocessing.get_context('spawn')) as executor:
+                    futures = [executor.submit(_runShard, config, jobdir, i, _shardPath(cachedir, i, 'db'), self.cachepath, claimttl) for i in pending]
+                    for future in as_completed(futures):
+                        claimed += future.result()
+            status = self.shardStatus(jobdir)
+            if not block or status['done'] >= status['shards']:
+                break
+            # the remaining shards are claimed by other hosts
+            time.sleep(min(5, claimttl / 2))
+        self.log(f'runSharded() ran {claimed} of {status["shards"]} shards, {status["done"]} done, completed in {time.perf_counter() - pcs:.4f}s', 'completed', function='runSharded', seconds=time.perf_counter() - pcs, **status)
+        return status
+
+    def _shardManifest(self, jobdir, operation, vintage, in_data, shards, kwargs):
+        manifestpath = os.path.join(jobdir, 'manifest.json')
+        lockpath = os.path.join(jobdir, 'manifest.lock')
+        while not os.path.exists(manifestpath):
+            try:
+                fd = os.open(lockpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                # another host is writing the shards and touches the lock while it does
+                try:
+                    stale = time.time() - os.path.getmtime(lockpath) > self.MANIFEST_TIMEOUT
+                except FileNotFoundError:
+                    continue
+                if stale and not os.path.exists(manifestpath):
+                    try:
+                        os.remove(lockpath)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                time.sleep(1)
+                continue
+            os.close(fd)
+            try:
+                return self._splitShards(jobdir, lockpath, manifestpath, operation, vintage, in_data, shards, kwargs)
+            except BaseException:
+                # let the next caller split the job instead of waiting for a manifest that never comes
+                try:
+                    os.remove(lockpath)
+                except FileNotFoundError:
+                    pass
+                raise
+        with open(manifestpath, 'rb') as rfile:
+            manifest = _jsonLoads(rfile.read())
+        # a jobdir holds exactly one job, joining it with different arguments would mix the results
+        expected = _jsonLoads(_jsonDumps({'operation': operation, 'vintage': vintage, 'kwargs': kwargs}))
+        for key in ['operation', 'vintage', 'kwargs']:
+            if manifest.get(key) != expected[key]:
+                raise Exception(f"runSharded() jobdir {jobdir} holds a job with {key} {manifest.get(key)!r}, not {expected[key]!r}")
+        return manifest
+
+    def _splitShards(self, jobdir, lockpath, manifestpath, operation, vintage, in_data, shards, kwargs):
+        if in_data is None:
+            raise Exception("runSharded() requires in_data for a new job")
+        if isinstance(in_data, str):
+            in_data = self.iterCsvRead(in_data)
+            if operation == 'attach':
+                # attach() takes uuids, not rows
+                in_data = (row['uuid'] for row in in_data)
+        files = [open(_shardPath(jobdir, i, 'jsonl'), 'wb') for i in range(shards)]
+        count = 0
+        heartbeat = time.time()
+        try:
+            for i, item in enumerate(in_data):
+                if operation == 'locate':
+                    # nearby points stay together so each shard can still pack them into bulk requests
+                    cell = str(_spatialCell(item['latitude'], item['longitude']))
+                    shard = int(hashlib.sha1(cell.encode()).hexdigest(), 16) % shards
+                else:
+                    shard = i % shards
+                files[shard].write(_jsonDumps(item) + b'\n')
+                count += 1
+                if count % 10000 == 0 and time.time() - heartbeat > 10:
+                    os.utime(lockpath)
+                    heartbeat = time.time()
+        finally:
+            for f in files:
+                f.close()
+        manifest = {'operation': operation, 'vintage': vintage, 'shards': shards, 'items': count, 'kwargs': kwargs, 'created': time.time()}
+        with open(manifestpath + '.tmp', 'wb') as wfile:
+            wfile.write(_jsonDumps(manifest))
+        os.replace(manifestpath + '.tmp', manifestpath)
+        return manifest
+
+    def shardStatus(self, jobdir):
+        with open(os.path.join(jobdir, 'manifest.json'), 'rb') as rfile:
+            manifest = _jsonLoads(rfile.read())
+        done = sum(1 for i in range(manifest['shards']) if os.path.exists(_shardPath(jobdir, i, 'result.jsonl')))
+        claimed = sum(1 for i in range(manifest['shards']) if os.path.exists(_shardPath(jobdir, i, 'lock')))
+        return {'shards': manifest['shards'], 'done': done, 'running': claimed - done, 'pending': manifest['shards'] - claimed}
+
+    def iterShardResults(self, jobdir):
+        with open(os.path.join(jobdir, 'manifest.json'), 'rb') as rfile:
+            manifest = _jsonLoads(rfile.read())
+        for i in range(manifest['shards']):
+            yield from self._jsonlRows(_shardPath(jobdir, i, 'result.jsonl'))
+
+    def mergeShardCaches(self, jobdir, cachedir=None):
+        cachedir = jobdir if cachedir is None else cachedir
+        with open(os.path.join(jobdir, 'manifest.json'), 'rb') as rfile:
+            manifest = _jsonLoads(rfile.read())
+        paths = [_shardPath(cachedir, i, 'db') for i in range(manifest['shards'])]
+        return self.mergeCache(*[p for p in paths if os.path.exists(p)])
 
     def getCredits(self, api, operation, method):
-        for a in self.listapis:
-            if a['api'] == api and a['operation'] == operation and a['method'] == method:
-                return a['credits']
-            
+        if self.apiindex is None:
+            self._loadCatalog()
+        a = self.apiindex.get((api, operation, method))
+        if a is not None:
+            return a['credits']
+
     def getMaxRequest(self, api, operation):
-        for a in self.listapis:
-            if a['api'] == api and a['operation'] == operation and a['method'] == 'POST':
-                return a['maxrequest']
+        if self.apiindex is None:
+            self._loadCatalog()
+        a = self.apiindex.get((api, operation, 'POST'))
+        if a is not None:
+            return a['maxrequest']
             
     def getFields(self, vintage, layer, datalevel=None, list_only=False):
         fields = self.apiAction(f'fabric/{vintage}/fields/{layer}', 'GET', usecache=False)
@@ -388,19 +2153,39 @@ class cqazapipytools:
         else:
             return fields
 
-    def collect(self, vintage, geojson, layer = 'locations'):
+    def collect(self, vintage, geojson, layer = 'locations', workers=4):
         pcs = time.perf_counter()
-        results = []
-        def doCollect(geojson):
-            curr_result = self.apiAction(self.baseurl + f'fabric/{vintage}/collect3/{layer}', 'POST', geojson)
-            if len(curr_result['continuations']) > 0:
-                for c in curr_result['continuations']:
-                    doCollect(c['body'])
-            else:
-                results.extend(curr_result['data'])
-        doCollect(geojson)
-        print(f'collect() completed in {time.perf_counter() - pcs:.4f}s')
-        return sorted(list(set(results)))
+        results = sorted(self._iterCollect(vintage, geojson, layer, workers))
+        self.log(f'collect() completed in {time.perf_counter() - pcs:.4f}s', 'completed', function='collect', seconds=time.perf_counter() - pcs)
+        return results
+
+    def iterCollect(self, vintage, geojson, layer = 'locations', workers=4):
+        pcs = time.perf_counter()
+        yield from self._iterCollect(vintage, geojson, layer, workers)
+        self.log(f'iterCollect() completed in {time.perf_counter() - pcs:.4f}s', 'completed', function='iterCollect', seconds=time.perf_counter() - pcs)
+
+    def _iterCollect(self, vintage, geojson, layer, workers):
+        # continuations are fetched concurrently as they are discovered, each uuid is yielded once
+        url = self.baseurl + f'fabric/{vintage}/collect3/{layer}'
+        seen = set()
+        with self.limiter.concurrency(workers):
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = {executor.submit(self.apiAction, url, 'POST', geojson)}
+                while len(futures) > 0:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        curr_result = future.result()
+                        if len(curr_result['continuations']) > 0:
+                            for c in curr_result['continuations']:
+                                futures.add(executor.submit(self.apiAction, url, 'POST', c['body']))
+                        else:
+                            for uuid in curr_result['data']:
+                                if uuid not in seen:
+                                    seen.add(uuid)
+                                    yield uuid
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
     
     def attach(self, vintage, in_list, fields=None, layer='locations', datalevel=None, workers=4):
         pcs = time.perf_counter()
@@ -429,39 +2214,36 @@ class cqazapipytools:
                 for k in list(r.keys()):
                     if k not in fields:
                         r.pop(k, None)
-            print(f'attach() completed in {time.perf_counter() - pcs:.4f}s')
+            self.log(f'attach() completed in {time.perf_counter() - pcs:.4f}s', 'completed', function='attach', seconds=time.perf_counter() - pcs)
             return sorted(results, key=lambda u: u['uuid'])
         else:
+            # every field group x uuid chunk request runs in one shared pool, rows are then merged once by uuid
             fieldgroups = self.chunkList(fields, 5)
-            results = []
-            for fg in fieldgroups:
-                fields = ','.join(fg)
-                results.append(self.bulkApiAction(self.baseurl + f'fabric/{vintage}/bulk/{layer}?field={fields}', 'POST', in_list, self.getMaxRequest('fabric','bulk'), workers))
+            urls = [self.baseurl + f'fabric/{vintage}/bulk/{layer}?field={",".join(fg)}' for fg in fieldgroups]
+            rows = {}
+            for r in self.bulkApiAction(urls, 'POST', in_list, self.getMaxRequest('fabric','bulk'), workers, itemkey='uuid' if self.itemcache else None):
+                if r is None:
+                    continue
+                if r['uuid'] in rows:
+                    rows[r['uuid']].update(r)
+                else:
+                    rows[r['uuid']] = r
+            order = ['uuid'] + fields
             merge_list = []
-            if len(results)>1:
-                for r in range(len(results)):
-                    if r == 0:
-                        merge_list = results[r]
-                    else:
-                        merge_list = self.mergeList(merge_list, results[r], 'uuid')
-            else:
-                merge_list = results[0]
-            print(f'attach() completed in {time.perf_counter() - pcs:.4f}s')
-            return sorted(merge_list, key=lambda u: u['uuid'])
+            for uuid in sorted(rows):
+                row = rows[uuid]
+                merge_list.append({**{k: row[k] for k in order if k in row}, **row})
+            self.log(f'attach() completed in {time.perf_counter() - pcs:.4f}s', 'completed', function='attach', seconds=time.perf_counter() - pcs)
+            return merge_list
     
-    def locate(self, vintage, in_list, opt_tolerance = 0.5, parceldistancem = None, neardistancem = None, parceltolerancem = None, footprinttolerancem = None, matchtype = None, workers=4):
+    def locate(self, vintage, in_list, opt_tolerance = 0.5, parceldistancem = None, neardistancem = None, parceltolerancem = None, footprinttolerancem = None, matchtype = None, workers=4, maxareakm2 = 9000):
         pcs = time.perf_counter()
+        # points repeated under different sourcekeys are located once
+        in_list, duplicates = self._dedupItems(in_list, 'sourcekey')
+        cells = {}
         for l in in_list:
-            l['res'] = 4
-        h3_assign = self.mergeList(in_list, self.bulkApiAction('geosvc/h3assign', 'POST', in_list, self.getMaxRequest('geosvc','h3assign'), 8), 'sourcekey')
-        for l in in_list:
-            l.pop('res', None)
-        h3_unique = {}
-        for r in h3_assign:
-            if r['h3'] not in h3_unique.keys():
-                h3_unique[r['h3']] = []
-            h3_unique[r['h3']].append(r)
-        print(f"Locating across {len(h3_unique)} h3_4s")
+            cells.setdefault(_spatialCell(l['latitude'], l['longitude']), []).append(l)
+        self.log(f"Locating across {len(cells)} {'h3_4s' if h3 is not None else 'cells'}", 'locate', cells=len(cells))
         results = []
         qs = {}
         if not parceldistancem is None:
@@ -478,38 +2260,85 @@ class cqazapipytools:
         if len(qs) > 0:
             q = '?'
         credit_cost = self.getCredits('fabricext','locate','POST')
-        single_requests = []
-        bulk_requests = []
-        for h3u in h3_unique:
-            if len(h3_unique[h3u]) < credit_cost * opt_tolerance:
-                for r in h3_unique[h3u]:
-                    single_requests.append(r)
-            else:
-                bulk_requests.extend(self.chunkList(h3_unique[h3u],1000))
-        results.extend(self.bulkApiAction(f"{self.baseurl}fabricext/{vintage}/locate{q}{urllib.parse.urlencode(qs)}", 'POST', bulk_requests, None, workers))
+        maxrequest = self.getMaxRequest('fabricext','locate') or 1000
+        bulk_requests, single_requests = self._planLocate(cells, credit_cost * opt_tolerance, min(maxrequest, 1000), maxareakm2)
+        self.log(f"Locating with {len(bulk_requests)} bulk and {len(single_requests)} single requests", 'locate', bulk=len(bulk_requests), single=len(single_requests))
+        results.extend(self.bulkApiAction(f"{self.baseurl}fabricext/{vintage}/locate{q}{urllib.parse.urlencode(qs)}", 'POST', bulk_requests, None, workers, itemkey='sourcekey' if self.itemcache else None))
         results.extend(self.bulkApiAction(f"{self.baseurl}fabricext/{vintage}/locate{q}{urllib.parse.urlencode(qs)}", 'GET', single_requests, 1, workers))
-        print(f'locate() completed in {time.perf_counter() - pcs:.4f}s')
+        results = self._fanOut(results, 'sourcekey', duplicates)
+        self.log(f'locate() completed in {time.perf_counter() - pcs:.4f}s', 'completed', function='locate', seconds=time.perf_counter() - pcs)
         return sorted(results,key=lambda u: u.get('sourcekey',''))
 
-    def match(self, vintage, in_list, workers=16):
+    def _planLocate(self, cells, threshold, maxrequest, maxareakm2):
+        # dense cells become their own bulk requests. points in sparse cells are packed along a z-order curve
+        # into batches whose bounding box stays under maxareakm2, and only batches still too small to be
+        # worth a POST fall back to single GET requests.
+        bulk_requests = []
+        single_requests = []
+        sparse = []
+        for cell in cells:
+            if len(cells[cell]) < threshold:
+                sparse.extend(cells[cell])
+            else:
+                bulk_requests.extend(self.chunkList(cells[cell], maxrequest))
+        sparse.sort(key=lambda l: _mortonKey(l['latitude'], l['longitude']))
+        batches = []
+        batch = []
+        bbox = None
+        for l in sparse:
+            lat = float(l['latitude'])
+            lng = float(l['longitude'])
+            if bbox is None:
+                candidate = (lat, lat, lng, lng)
+            else:
+                candidate = (min(bbox[0], lat), max(bbox[1], lat), min(bbox[2], lng), max(bbox[3], lng))
+            if len(batch) > 0 and (len(batch) >= maxrequest or _bboxAreaKm2(*candidate) > maxareakm2):
+                batches.append(batch)
+                batch = []
+                candidate = (lat, lat, lng, lng)
+            batch.append(l)
+            bbox = candidate
+        if len(batch) > 0:
+            batches.append(batch)
+        for batch in batches:
+            if len(batch) < threshold:
+                single_requests.extend(batch)
+            else:
+                bulk_requests.append(batch)
+        return bulk_requests, single_requests
+
+    def match(self, vintage, in_list, workers=16, adaptive=False):
         pcs = time.perf_counter()
         results = []
+        # addresses repeated under different sourcekeys are matched once
+        in_list, duplicates = self._dedupItems(in_list, 'sourcekey')
         if len(in_list) * self.getCredits('fabricext','match','GET') < self.getCredits('fabricext','match','POST'):
             results = self.bulkApiAction(f'fabricext/{vintage}/match', 'GET', in_list, 1, workers)
         else:
-            results = self.bulkApiAction(f'fabricext/{vintage}/match', 'POST', in_list, self.getMaxRequest('fabricext','match'), workers)
-        print(f'match() completed in {time.perf_counter() - pcs:.4f}s')
+            results = self.bulkApiAction(f'fabricext/{vintage}/match', 'POST', in_list, self.getMaxRequest('fabricext','match'), workers, itemkey='sourcekey' if self.itemcache else None, adaptive=adaptive)
+        results = self._fanOut(results, 'sourcekey', duplicates)
+        self.log(f'match() completed in {time.perf_counter() - pcs:.4f}s', 'completed', function='match', seconds=time.perf_counter() - pcs)
         return results
 
+    def iterMatch(self, vintage, in_iter, workers=16, ordered=False):
+        pcs = time.perf_counter()
+        # the GET/POST credit comparison needs a length, unsized iterables always use POST
+        if hasattr(in_iter, '__len__') and len(in_iter) * self.getCredits('fabricext','match','GET') < self.getCredits('fabricext','match','POST'):
+            yield from self.iterBulkApiAction(f'fabricext/{vintage}/match', 'GET', in_iter, 1, workers, ordered=ordered)
+        else:
+            yield from self.iterBulkApiAction(f'fabricext/{vintage}/match', 'POST', in_iter, self.getMaxRequest('fabricext','match'), workers, ordered=ordered, itemkey='sourcekey' if self.itemcache else None)
+        self.log(f'iterMatch() completed in {time.perf_counter() - pcs:.4f}s', 'completed', function='iterMatch', seconds=time.perf_counter() - pcs)
+
     def convert(self, filepath):
         pcs = time.perf_counter()
         url = f'{self.baseurl}geosvc/convert'
         with open(filepath, 'rb') as file:
             files = {'file': file}
-            response = requests.post(url, files=files, headers={'apikey': self.apikey})
+            with self.transport.session() as session:
+                response = self.transport.request(session, 'POST', url, files=files, headers={'apikey': self.apikey})
         if response.status_code != 200:
-            print(f'convert failed with status code {response.status_code} and message {response.text} \n url: {url} \n filepath: {filepath}')
+            self.log(f'convert failed with status code {response.status_code} and message {response.text} \n url: {url} \n filepath: {filepath}', 'request_failed', url=url, method='POST', status=response.status_code)
             raise Exception(f'Error converting file: {filepath}')
         else:
-            print(f'convert() completed in {time.perf_counter() - pcs:.4f}s')
+            self.log(f'convert() completed in {time.perf_counter() - pcs:.4f}s', 'completed', function='convert', seconds=time.perf_counter() - pcs)
             return response.json()
@@ -0,0 +1,206 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from .mockserver import MockServer, fakeUuid
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# runs each scenario in its own process against the local mock server and reports throughput,
+# client side request latency and peak memory. e.g. from the directory containing cqazapipytools:
+#   python -m cqazapipytools.benchmark --size 20000 --workers 16 --latency 0.02
+
+
+def uuids(n):
+    return [fakeUuid(i) for i in range(n)]
+
+
+def addresses(n, duplicates=0.0):
+    rng = random.Random(1)
+    rows = []
+    for i in range(n):
+        house = rng.randint(1, int(n * (1 - duplicates)) + 1) if duplicates > 0 else i
+        rows.append({'sourcekey': str(i), 'text': f'{house} Main St Springfield IL 62701'})
+    return rows
+
+
+def coordinates(n, clustered=0.5):
+    rng = random.Random(2)
+    rows = []
+    for i in range(n):
+        if rng.random() < clustered:
+            rows.append({'sourcekey': str(i), 'latitude': 39.78 + rng.random() * 0.2, 'longitude': -89.65 + rng.random() * 0.2})
+        else:
+            rows.append({'sourcekey': str(i), 'latitude': rng.uniform(25, 49), 'longitude': rng.uniform(-124, -67)})
+    return rows
+
+
+def scenarioBulkGet(cp, args):
+    return len(cp.bulkApiAction('fabric/202412/data/locations', 'GET', [{'uuid': u} for u in uuids(args.size)], 1, args.workers))
+
+
+def scenarioBulkPost(cp, args):
+    return len(cp.bulkApiAction('fabric/202412/bulk/locations?field=field01,field02', 'POST', uuids(args.size), 1000, args.workers))
+
+
+def scenarioAttach(cp, args):
+    return len(cp.attach('202412', uuids(args.size), datalevel=20, workers=args.workers))
+
+
+def scenarioCollect(cp, args):
+    return len(cp.collect('202412', {'type': 'Feature'}, workers=args.workers))
+
+
+def scenarioLocate(cp, args):
+    return len(cp.locate('202506', coordinates(args.size), workers=args.workers))
+
+
+def scenarioMatch(cp, args):
+    return len(cp.match('202506', addresses(args.size), workers=args.workers))
+
+
+def scenarioCacheCold(cp, args):
+    return len(cp.bulkApiAction('fabric/202412/data/locations', 'GET', [{'uuid': u} for u in uuids(args.size)], 1, args.workers))
+
+
+def scenarioCacheWarm(cp, args):
+    # the measured run is the second one, fully served from the cache
+    inputs = [{'uuid': u} for u in uuids(args.size)]
+    cp.bulkApiAction('fabric/202412/data/locations', 'GET', inputs, 1, args.workers)
+    cp.flushCache()
+    return ('reset', lambda: len(cp.bulkApiAction('fabric/202412/data/locations', 'GET', inputs, 1, args.workers)))
+
+
+def scenarioCsvIo(cp, args):
+    rows = [{'uuid': u, 'nested': {'a': i, 'b': [i, i + 1]}, 'text': 'x' * 40} for i, u in enumerate(uuids(args.size))]
+    path = os.path.join(args.tempdir, 'bench.csv')
+    cp.csvWrite(path, rows)
+    return len(cp.csvRead(path))
+
+
+SCENARIOS = {
+    'bulk_get': (scenarioBulkGet, False),
+    'bulk_post': (scenarioBulkPost, False),
+    'attach': (scenarioAttach, False),
+    'collect': (scenarioCollect, False),
+    'locate': (scenarioLocate, False),
+    'match': (scenarioMatch, False),
+    'cache_cold': (scenarioCacheCold, True),
+    'cache_warm': (scenarioCacheWarm, True),
+    'csv_io': (scenarioCsvIo, False),
+}
+
+
+def percentile(values, pct):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def peakRssMb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def runChild(args):
+    from .. import cqazapipytools
+    latencies = []
+    send = requests.Session.send
+    def timedSend(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(self, request, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    requests.Session.send = timedSend
+    fn, usescache = SCENARIOS[args.child]
+    cachepath = os.path.join(args.tempdir, f'{args.child}.db') if usescache else None
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), cqazapipytools('benchmark', baseurl=args.baseurl, cachepath=cachepath, quietmode=True) as cp:
+        latencies.clear()
+        start = time.perf_counter()
+        items = fn(cp, args)
+        if isinstance(items, tuple) and items[0] == 'reset':
+            latencies.clear()
+            start = time.perf_counter()
+            items = items[1]()
+        elapsed = time.perf_counter() - start
+    result = {
+        'scenario': args.child,
+        'items': items,
+        'seconds': round(elapsed, 3),
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        'items_per_s': round(items / elapsed, 1) if elapsed > 0 else None,
+        'p50_ms': None if len(latencies) == 0 else round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': None if len(latencies) == 0 else round(percentile(latencies, 99) * 1000, 2),
+        'peak_rss_mb': peakRssMb(),
+    }
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for cqazapipytools against a local mock CostQuest API')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument('--size', type=int, default=5000, help='input rows per scenario')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.01, help='mock server seconds per response')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error429', type=float, default=0.0)
+    parser.add_argument('--error5xx', type=float, default=0.0)
+    parser.add_argument('--retryafter', type=int, default=1)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--leafsize', type=int, default=250)
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--baseurl', help=argparse.SUPPRESS)
+    parser.add_argument('--tempdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return runChild(args)
+
+    package = __package__.rsplit('.', 1)[0]
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    results = []
+    with MockServer(latency=args.latency, jitter=args.jitter, error429=args.error429, error5xx=args.error5xx, retryafter=args.retryafter, fanout=args.fanout, depth=args.depth, leafsize=args.leafsize) as server, tempfile.TemporaryDirectory() as tempdir:
+        for scenario in args.scenarios.split(','):
+            if scenario not in SCENARIOS:
+                raise Exception(f'Unknown scenario {scenario}')
+            before = server.snapshot()
+            child = subprocess.run([sys.executable, '-m', f'{package}.benchmark', '--child', scenario, '--baseurl', server.url, '--tempdir', tempdir,
+                                    '--size', str(args.size), '--workers', str(args.workers)], env=env, capture_output=True, text=True)
+            if child.returncode != 0:
+                print(f'{scenario} failed:\n{child.stderr}')
+                continue
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            after = server.snapshot()
+            result['server_requests'] = after['requests'] - before['requests']
+            result['injected_errors'] = (after['429'] - before['429']) + (after['5xx'] - before['5xx'])
+            results.append(result)
+            print(f"{scenario:<12} {result['items']:>9} items {result['seconds']:>9.3f}s {result['rps'] or 0:>9.1f} req/s  p50 {result['p50_ms'] or 0:>8.2f}ms  p99 {result['p99_ms'] or 0:>8.2f}ms  rss {result['peak_rss_mb'] or 0:>7.1f}MB")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
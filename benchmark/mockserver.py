@@ -0,0 +1,207 @@
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+import argparse
+import socket
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# local stand-in for the CostQuest API used by the benchmarks. responses are shaped like the real
+# endpoints but filled with deterministic fake data, no credits are used.
+
+APIS = [
+    {'api': 'fabric', 'operation': 'data', 'method': 'GET', 'credits': 1, 'maxrequest': 1},
+    {'api': 'fabric', 'operation': 'bulk', 'method': 'POST', 'credits': 10, 'maxrequest': 1000},
+    {'api': 'fabric', 'operation': 'collect3', 'method': 'POST', 'credits': 1, 'maxrequest': 1},
+    {'api': 'fabricext', 'operation': 'match', 'method': 'GET', 'credits': 1, 'maxrequest': 1},
+    {'api': 'fabricext', 'operation': 'match', 'method': 'POST', 'credits': 10, 'maxrequest': 1000},
+    {'api': 'fabricext', 'operation': 'locate', 'method': 'GET', 'credits': 1, 'maxrequest': 1},
+    {'api': 'fabricext', 'operation': 'locate', 'method': 'POST', 'credits': 10, 'maxrequest': 1000},
+    {'api': 'geosvc', 'operation': 'h3assign', 'method': 'POST', 'credits': 0, 'maxrequest': 10000},
+]
+
+FIELDS = [{'fieldname': f'field{i:02d}', 'datalevel': i} for i in range(1, 21)]
+
+NAMESPACE = uuid.UUID('6f1c4b0e-8a55-4c1e-9f7d-3c2b1a000000')
+
+
+def fakeUuid(key):
+    return str(uuid.uuid5(NAMESPACE, str(key)))
+
+
+class _Server(ThreadingHTTPServer):
+    # the default listen backlog of 5 stalls bursts of new connections for a SYN retry
+    request_queue_size = 256
+
+
+class MockServer:
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error429=0.0, error5xx=0.0, retryafter=1, fanout=4, depth=2, leafsize=250, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error429 = error429
+        self.error5xx = error5xx
+        self.retryafter = retryafter
+        self.fanout = fanout
+        self.depth = depth
+        self.leafsize = leafsize
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, '429': 0, '5xx': 0}
+        server = self
+        class Handler(_Handler):
+            mock = server
+        self.httpd = _Server((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def inject(self):
+        with self.lock:
+            self.counts['requests'] += 1
+            roll = self.random.random()
+            if roll < self.error429:
+                self.counts['429'] += 1
+                return 429
+            if roll < self.error429 + self.error5xx:
+                self.counts['5xx'] += 1
+                return 503
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately, without this delayed acks add ~40ms to every response
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.dispatch(None)
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            import gzip
+            raw = gzip.decompress(raw)
+        self.dispatch(json.loads(raw) if raw else None)
+
+    def dispatch(self, body):
+        error = self.mock.inject()
+        if error == 429:
+            return self.send(429, {'error': 'rate limited'}, {'Retry-After': str(self.mock.retryafter)})
+        if error is not None:
+            return self.send(error, {'error': 'injected failure'})
+        parsed = urllib.parse.urlparse(self.path)
+        qs = dict(urllib.parse.parse_qsl(parsed.query))
+        path = parsed.path.strip('/').split('/')
+        try:
+            if path[:2] == ['accountcontrol', 'listapis']:
+                return self.send(200, APIS)
+            if path[0] == 'fabric' and path[2] == 'fields':
+                return self.send(200, FIELDS)
+            if path[0] == 'fabric' and path[2] == 'data':
+                return self.send(200, self.fabricRow(qs['uuid'], [f['fieldname'] for f in FIELDS]))
+            if path[0] == 'fabric' and path[2] == 'bulk':
+                fields = qs.get('field', '').split(',')
+                return self.send(200, [self.fabricRow(u, fields) for u in body])
+            if path[0] == 'fabric' and path[2] == 'collect3':
+                return self.send(200, self.collect(body))
+            if path[0] == 'fabricext' and path[2] == 'match':
+                if self.command == 'GET':
+                    return self.send(200, self.matchRow(qs))
+                return self.send(200, [self.matchRow(i) for i in body])
+            if path[0] == 'fabricext' and path[2] == 'locate':
+                if self.command == 'GET':
+                    return self.send(200, [self.locateRow(qs)])
+                return self.send(200, [self.locateRow(i) for i in body])
+            if path[:2] == ['geosvc', 'h3assign']:
+                return self.send(200, [{'sourcekey': i['sourcekey'], 'h3': f"{int(float(i['latitude']) / 0.4)}_{int(float(i['longitude']) / 0.4)}"} for i in body])
+        except (KeyError, IndexError, TypeError) as e:
+            return self.send(400, {'error': f'bad request: {e}'})
+        self.send(404, {'error': f'unknown endpoint {parsed.path}'})
+
+    def fabricRow(self, u, fields):
+        row = {'uuid': u}
+        for f in fields:
+            row[f] = f'{f}-{u[:8]}'
+        return row
+
+    def collect(self, body):
+        # the first request fans out into `fanout` continuations per level down to `depth`, leaves return `leafsize` uuids
+        properties = body.get('mock', {}) if isinstance(body, dict) else {}
+        level = properties.get('level', 0)
+        node = properties.get('node', 'root')
+        if level < self.mock.depth:
+            return {'continuations': [{'body': {'type': 'Feature', 'mock': {'level': level + 1, 'node': f'{node}.{i}'}}} for i in range(self.mock.fanout)], 'data': []}
+        return {'continuations': [], 'data': [fakeUuid(f'{node}-{j}') for j in range(self.mock.leafsize)]}
+
+    def matchRow(self, item):
+        return {'sourcekey': item.get('sourcekey'), 'uuid': fakeUuid(item.get('text', item.get('road', ''))), 'matchtype': 'Address', 'score': 1.0}
+
+    def locateRow(self, item):
+        return {'sourcekey': item.get('sourcekey'), 'uuid': fakeUuid(f"{item.get('latitude')},{item.get('longitude')}"), 'matchtype': 'Footprint', 'latitude': item.get('latitude'), 'longitude': item.get('longitude')}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the CostQuest API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- seconds of random latency')
+    parser.add_argument('--error429', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--error5xx', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--retryafter', type=int, default=1)
+    parser.add_argument('--fanout', type=int, default=4, help='collect3 continuations per level')
+    parser.add_argument('--depth', type=int, default=2, help='collect3 continuation levels')
+    parser.add_argument('--leafsize', type=int, default=250, help='uuids per collect3 leaf')
+    args = parser.parse_args()
+    server = MockServer(args.host, args.port, args.latency, args.jitter, args.error429, args.error5xx, args.retryafter, args.fanout, args.depth, args.leafsize)
+    print(f'Mock CostQuest API listening on {server.url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
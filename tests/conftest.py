@@ -0,0 +1,36 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# the repository root is the package itself, load it under its import name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if 'cqazapipytools' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('cqazapipytools', os.path.join(ROOT, '__init__.py'), submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['cqazapipytools'] = module
+    spec.loader.exec_module(module)
+
+from cqazapipytools import cqazapipytools
+from cqazapipytools.benchmark.mockserver import MockServer
+
+
+@pytest.fixture
+def mock():
+    with MockServer(seed=1) as server:
+        yield server
+
+
+@pytest.fixture
+def client(mock, tmp_path):
+    clients = []
+    def make(**kwargs):
+        kwargs.setdefault('catalogpath', str(tmp_path / 'catalog.json'))
+        cp = cqazapipytools('test', mock.url, quietmode=True, **kwargs)
+        cp.removeHook(cp.printHook)
+        clients.append(cp)
+        return cp
+    yield make
+    for cp in clients:
+        cp.__exit__(None, None, None)
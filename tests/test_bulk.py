@@ -0,0 +1,22 @@
+def test_adaptive_match_with_itemcache(client, mock, tmp_path):
+    cp = client(cachepath=str(tmp_path / 'cache.db'), itemcache=True)
+    in_list = [{'sourcekey': str(i), 'text': f'{i} Main St'} for i in range(500)]
+    first = cp.match('202412', in_list, workers=4, adaptive=True)
+    assert sorted(r['sourcekey'] for r in first) == sorted(i['sourcekey'] for i in in_list)
+    cp.flushCache()
+    requests = mock.snapshot()['requests']
+    second = cp.match('202412', in_list, workers=4, adaptive=True)
+    assert mock.snapshot()['requests'] == requests
+    assert sorted(first, key=lambda r: r['sourcekey']) == sorted(second, key=lambda r: r['sourcekey'])
+
+
+def test_request_is_hashed_once(client, mock, tmp_path):
+    calls = []
+    for kwargs in [{'cachepath': str(tmp_path / 'cache.db')}, {}]:
+        cp = client(**kwargs)
+        original = cp.createHash
+        cp.createHash = lambda *args: calls.append(args) or original(*args)
+        cp.apiAction('fabric/202412/bulk/locations?field=field01', 'POST', ['a', 'b'])
+        cp.flushCache()
+        assert cp.apiAction('fabric/202412/bulk/locations?field=field01', 'POST', ['a', 'b'], usecache=False) is not None
+    assert len(calls) == 1
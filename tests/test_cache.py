@@ -0,0 +1,104 @@
+import json
+import sqlite3
+import threading
+from contextlib import closing
+
+import pytest
+
+from cqazapipytools import _CacheEngine
+
+
+def baselineCache(path, rows):
+    # the schema written by versions before the cache engine: no unique key, json text payloads
+    with closing(sqlite3.connect(path)) as cn:
+        cn.execute('create table if not exists cache (hashvalue text, response text);')
+        cn.execute('create index if not exists hashvalue_index on cache (hashvalue);')
+        cn.executemany('insert into cache (hashvalue, response) values (?,?);', [(h, json.dumps(r)) for h, r in rows])
+        cn.commit()
+
+
+def test_migrates_baseline_cache(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    baselineCache(path, [('a', {'v': 1}), ('b', [1, 2]), ('a', {'v': 2}), ('c', 'text')])
+    cache = _CacheEngine(path)
+    try:
+        assert cache.getMany(['a', 'b', 'c', 'd']) == {'a': {'v': 2}, 'b': [1, 2], 'c': 'text'}
+        assert cache.stats()['entries'] == 3
+    finally:
+        cache.close()
+    with closing(sqlite3.connect(path)) as cn:
+        assert cn.execute('PRAGMA user_version;').fetchone()[0] == 2
+        assert cn.execute("select count(*) from cache where hashvalue='a';").fetchone()[0] == 1
+        columns = [r[1] for r in cn.execute('PRAGMA table_info(cache);')]
+    assert columns == ['hashvalue', 'response', 'encoding', 'created', 'accessed', 'size', 'endpoint', 'vintage']
+
+
+def test_migration_is_idempotent(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    baselineCache(path, [('a', {'v': 1})])
+    _CacheEngine(path).close()
+    cache = _CacheEngine(path)
+    try:
+        assert cache.get('a') == {'v': 1}
+    finally:
+        cache.close()
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_put_flush_get(tmp_path, compression):
+    path = str(tmp_path / 'cache.db')
+    cache = _CacheEngine(path, compression)
+    response = [{'uuid': 'é', 'n': i} for i in range(50)]
+    cache.put('h1', response, 'https://api.costquest.com/fabric/202412/data/locations')
+    cache.put('h2', None, raw=b'{"raw": true}')
+    cache.flush()
+    assert cache.getMany(['h1', 'h2']) == {'h1': response, 'h2': {'raw': True}}
+    cache.close()
+    reopened = _CacheEngine(path)
+    try:
+        assert reopened.get('h1') == response
+        with closing(sqlite3.connect(path)) as cn:
+            assert cn.execute("select encoding, endpoint, vintage from cache where hashvalue='h1';").fetchone() == (compression or 'json', 'fabric/data/locations', '202412')
+    finally:
+        reopened.close()
+
+
+def test_reads_see_pending_writes(tmp_path):
+    cache = _CacheEngine(str(tmp_path / 'cache.db'))
+    try:
+        # hold the writer thread so the entry can only be served from the pending writes
+        release = threading.Event()
+        cache.writequeue.put(('call', lambda cn: release.wait(), None))
+        cache.put('h', {'pending': True})
+        with closing(sqlite3.connect(cache.path)) as cn:
+            assert cn.execute('select count(*) from cache;').fetchone()[0] == 0
+        assert cache.get('h') == {'pending': True}
+        release.set()
+        cache.flush()
+        assert cache.get('h') == {'pending': True}
+    finally:
+        cache.close()
+
+
+def test_upsert_replaces_entry(tmp_path):
+    cache = _CacheEngine(str(tmp_path / 'cache.db'))
+    try:
+        cache.put('h', {'v': 1})
+        cache.flush()
+        cache.put('h', {'v': 2})
+        cache.flush()
+        assert cache.get('h') == {'v': 2}
+        assert cache.stats()['entries'] == 1
+    finally:
+        cache.close()
+
+
+def test_client_cache_round_trip(client, mock, tmp_path):
+    cp = client(cachepath=str(tmp_path / 'cache.db'))
+    uuids = [str(i) for i in range(30)]
+    first = cp.bulkApiAction('fabric/202412/bulk/locations?field=field01', 'POST', uuids, 10)
+    cp.flushCache()
+    requests = mock.snapshot()['requests']
+    second = cp.bulkApiAction('fabric/202412/bulk/locations?field=field01', 'POST', uuids, 10)
+    assert mock.snapshot()['requests'] == requests
+    assert sorted(first, key=lambda r: r['uuid']) == sorted(second, key=lambda r: r['uuid'])
@@ -0,0 +1,53 @@
+import asyncio
+import json
+import os
+import stat
+import tempfile
+
+
+def test_default_path_is_next_to_cache(client, tmp_path):
+    cp = client(cachepath=str(tmp_path / 'cache.db'), catalogpath=None)
+    assert os.path.dirname(cp.catalogpath) == str(tmp_path)
+    cp.refreshCatalog()
+    assert stat.S_IMODE(os.stat(cp.catalogpath).st_mode) == 0o600
+
+
+def test_default_path_is_per_user(client, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    cp = client(catalogpath=None)
+    assert not cp.catalogpath.startswith(tempfile.gettempdir() + os.sep + 'cqazapipytools-')
+    cp.refreshCatalog()
+    assert os.path.dirname(cp.catalogpath) == str(tmp_path / 'xdg' / 'cqazapipytools')
+    assert stat.S_IMODE(os.stat(os.path.dirname(cp.catalogpath)).st_mode) == 0o700
+
+
+def test_malformed_catalog_is_fetched_again(client, mock):
+    cp = client()
+    cp.refreshCatalog()
+    with open(cp.catalogpath) as rfile:
+        catalog = json.load(rfile)
+    catalog['listapis'][1]['maxrequest'] = 'everything'
+    with open(cp.catalogpath, 'w') as wfile:
+        json.dump(catalog, wfile)
+    requests = mock.snapshot()['requests']
+    fresh = client()
+    assert fresh.getMaxRequest('fabric', 'bulk') == 1000
+    assert mock.snapshot()['requests'] == requests + 1
+
+
+def test_symlink_is_replaced_not_followed(client, tmp_path):
+    target = tmp_path / 'target'
+    target.write_text('untouched')
+    cp = client()
+    os.symlink(target, cp.catalogpath)
+    cp.refreshCatalog()
+    assert target.read_text() == 'untouched'
+    assert not os.path.islink(cp.catalogpath)
+
+
+def test_async_bulk_loads_catalog_first(client):
+    cp = client()
+    assert cp.apiindex is None
+    results = asyncio.run(cp.abulkApiAction('fabric/202412/bulk/locations?field=field01', 'POST', [str(i) for i in range(20)], 10))
+    assert len(results) == 20
+    assert cp.apiindex is not None
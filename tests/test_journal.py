@@ -0,0 +1,37 @@
+URL = 'fabric/202412/bulk/locations?field=field01'
+
+
+def test_resumes_only_unfinished_batches(client, mock, tmp_path):
+    cp = client(journalpath=str(tmp_path / 'jobs.db'), maxretries=0)
+    uuids = [str(i) for i in range(40)]
+    mock.error5xx = 1.0
+    assert cp.bulkApiAction(URL, 'POST', uuids, 10, ignoreerrors=True) == []
+    assert [(j['done'], j['pending'], j['failed']) for j in cp.journalJobs()] == [(0, 0, 4)]
+    mock.error5xx = 0.0
+    results = cp.bulkApiAction(URL, 'POST', uuids, 10)
+    assert sorted(r['uuid'] for r in results) == sorted(uuids)
+    assert cp.journalJobs() == []
+
+
+def test_finished_job_is_not_replayed(client, mock, tmp_path):
+    cp = client(journalpath=str(tmp_path / 'jobs.db'))
+    uuids = [str(i) for i in range(40)]
+    cp.bulkApiAction(URL, 'POST', uuids, 10)
+    requests = mock.snapshot()['requests']
+    results = cp.bulkApiAction(URL, 'POST', uuids, 10)
+    assert mock.snapshot()['requests'] == requests + 4
+    assert len(results) == 40
+    assert cp.journalJobs() == []
+
+
+def test_usecache_false_skips_journal(client, mock, tmp_path):
+    cp = client(journalpath=str(tmp_path / 'jobs.db'), maxretries=0)
+    cp.refreshCatalog()
+    uuids = [str(i) for i in range(40)]
+    mock.error5xx = 1.0
+    cp.bulkApiAction(URL, 'POST', uuids, 10, ignoreerrors=True)
+    mock.error5xx = 0.0
+    requests = mock.snapshot()['requests']
+    cp.bulkApiAction(URL, 'POST', uuids, 10, usecache=False)
+    assert mock.snapshot()['requests'] == requests + 4
+    assert len(cp.journalJobs()) == 1
@@ -0,0 +1,102 @@
+import os
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ITEMS = [{'sourcekey': str(i), 'text': f'{i} Main St'} for i in range(40)]
+
+
+@pytest.fixture
+def importable(tmp_path, monkeypatch):
+    # spawned shard processes import the package by name
+    os.symlink(ROOT, tmp_path / 'cqazapipytools')
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+
+def test_run_and_rerun(client, importable, tmp_path):
+    cp = client(cachepath=str(tmp_path / 'cache.db'), itemcache=True)
+    jobdir = str(tmp_path / 'job')
+    status = cp.runSharded('match', ITEMS, jobdir, '202412', shards=2, processes=1)
+    assert status == {'shards': 2, 'done': 2, 'running': 0, 'pending': 0}
+    assert sorted(r['sourcekey'] for r in cp.iterShardResults(jobdir)) == sorted(i['sourcekey'] for i in ITEMS)
+    assert cp.runSharded('match', None, jobdir, '202412', processes=1) == status
+
+
+def test_manifest_must_match_call(client, tmp_path):
+    cp = client()
+    jobdir = str(tmp_path / 'job')
+    os.makedirs(jobdir)
+    cp._shardManifest(jobdir, 'match', '202412', ITEMS, 2, {'workers': 4})
+    assert cp._shardManifest(jobdir, 'match', '202412', None, 8, {'workers': 4})['shards'] == 2
+    with pytest.raises(Exception, match='operation'):
+        cp._shardManifest(jobdir, 'attach', '202412', None, 2, {'workers': 4})
+    with pytest.raises(Exception, match='vintage'):
+        cp._shardManifest(jobdir, 'match', '202506', None, 2, {'workers': 4})
+    with pytest.raises(Exception, match='kwargs'):
+        cp._shardManifest(jobdir, 'match', '202412', None, 2, {'workers': 8})
+
+
+def test_stale_manifest_lock_is_taken_over(client, tmp_path):
+    cp = client()
+    jobdir = str(tmp_path / 'job')
+    os.makedirs(jobdir)
+    lockpath = os.path.join(jobdir, 'manifest.lock')
+    open(lockpath, 'w').close()
+    old = time.time() - cp.MANIFEST_TIMEOUT - 1
+    os.utime(lockpath, (old, old))
+    assert cp._shardManifest(jobdir, 'match', '202412', ITEMS, 2, {})['items'] == len(ITEMS)
+
+
+def test_failed_split_releases_lock(client, tmp_path):
+    cp = client()
+    jobdir = str(tmp_path / 'job')
+    os.makedirs(jobdir)
+    with pytest.raises(Exception, match='requires in_data'):
+        cp._shardManifest(jobdir, 'match', '202412', None, 2, {})
+    assert not os.path.exists(os.path.join(jobdir, 'manifest.lock'))
+
+
+def test_dead_claim_is_taken_over_while_waiting(client, importable, tmp_path):
+    cp = client()
+    jobdir = str(tmp_path / 'job')
+    os.makedirs(jobdir)
+    cp._shardManifest(jobdir, 'match', '202412', ITEMS, 2, {})
+    # a claim left behind by a host that died just now
+    open(os.path.join(jobdir, 'shard-00001.lock'), 'w').close()
+    start = time.time()
+    status = cp.runSharded('match', None, jobdir, '202412', processes=1, claimttl=2)
+    assert status['done'] == 2
+    assert time.time() - start < 30
+    assert len(list(cp.iterShardResults(jobdir))) == len(ITEMS)
+
+
+def test_running_claim_is_refreshed(client, mock, tmp_path):
+    import threading
+    from cqazapipytools import _runShard, _claimShard
+    cp = client()
+    jobdir = str(tmp_path / 'job')
+    os.makedirs(jobdir)
+    cp._shardManifest(jobdir, 'match', '202412', ITEMS, 1, {})
+    cp.refreshCatalog()
+    mock.latency = 2.5
+    config = {'apikey': 'test', 'baseurl': mock.url, 'quietmode': True, 'catalogpath': cp.catalogpath}
+    runner = threading.Thread(target=_runShard, args=(config, jobdir, 0, str(tmp_path / 'shard.db'), None, 1))
+    runner.start()
+    time.sleep(1.8)
+    # the shard has run longer than claimttl but its claim is still fresh
+    assert not _claimShard(jobdir, 0, 1)
+    runner.join()
+    assert os.path.exists(os.path.join(jobdir, 'shard-00000.result.jsonl'))
+
+
+def test_attach_from_csv(client, importable, tmp_path):
+    cp = client()
+    path = tmp_path / 'uuids.csv'
+    path.write_text('uuid,name\n' + ''.join(f'{i:08d}-uuid,n{i}\n' for i in range(30)))
+    jobdir = str(tmp_path / 'job')
+    status = cp.runSharded('attach', str(path), jobdir, '202412', shards=2, processes=1, fields=['field01'])
+    assert status['done'] == 2
+    rows = list(cp.iterShardResults(jobdir))
+    assert sorted(r['uuid'] for r in rows) == [f'{i:08d}-uuid' for i in range(30)]
+    assert all(r['field01'] == f"field01-{r['uuid'][:8]}" for r in rows)